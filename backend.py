@@ -0,0 +1,155 @@
+import numpy as np # for array math
+from multiprocessing import Pipe, Process # for running the analysis on another core
+from multiprocessing import shared_memory, resource_tracker # for exchanging frames without pickling
+from concurrent.futures import ThreadPoolExecutor # for filtering tiles in parallel
+import traceback # for passing worker errors
+import logging # for more advanced prints
+from imgproc import Analysis # for analysing the frames
+
+
+log = logging.getLogger(f'spotter_{__name__}')
+
+
+class SharedFrames:
+    '''
+    Frames of the same shape in one shared memory block
+    '''
+    # layout of the block as (name, dtype)
+    layout = (('new', np.int32), ('old', np.int32), ('diff', np.int32), ('mask', np.bool_))
+
+    def __init__(self, shape, name=None):
+        '''
+        :param shape: (h, w) of the frames
+        :param name: name of an existing block to attach to, None to create a new one
+        '''
+        self.shape = shape
+        size = sum(np.dtype(dtype).itemsize for _, dtype in self.layout)*shape[0]*shape[1]
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # the creating process takes care of unlinking the block
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        
+        # map frames on block
+        offset = 0
+        for key, dtype in self.layout:
+            frame = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, key, frame)
+            offset += frame.nbytes
+    
+
+    @property
+    def name(self):
+        return self.shm.name
+    
+
+    def close(self, unlink=False):
+        '''
+        Releases the block
+
+        :param unlink: True to destroy the block, only for the creating process
+        '''
+        for key, _ in self.layout:
+            setattr(self, key, None) # release views on buffer
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def analysisWorker(conn, tileWorkers=0):
+    '''
+    Worker process loop running the Analysis on shared frames
+
+    :param conn: pipe connection receiving (block name, shape, thresh, kwargs)
+        and returning ('ok', summary) or ('error', traceback string)
+    :param tileWorkers: number of threads to filter tiles in parallel, 0 to filter at once
+    '''
+    frames = None
+    pool = ThreadPoolExecutor(tileWorkers) if tileWorkers > 0 else None
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        
+        name, shape, thresh, kwargs = task
+        try:
+            # attach to new block
+            if frames is None or frames.name != name:
+                if frames:
+                    frames.close()
+                frames = SharedFrames(shape, name)
+            
+            analysis = Analysis(frames.new, frames.old, thresh, pool=pool, **kwargs)
+            frames.diff[...] = analysis.diff
+            frames.mask[...] = analysis.mask
+            conn.send(('ok', analysis.summary()))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    
+    if frames:
+        frames.close()
+    if pool:
+        pool.shutdown()
+
+
+class ProcessBackend:
+    '''
+    Runs the Analysis in a worker process to use another core
+
+    Frames are passed through shared memory, only parameters and results are pickled
+    '''
+    def __init__(self, tileWorkers=0):
+        '''
+        :param tileWorkers: number of threads in the worker process to filter tiles in parallel
+        '''
+        self.frames = None
+        self.conn, workerConn = Pipe()
+        self.process = Process(target=analysisWorker, args=(workerConn, tileWorkers), name='analysis backend', daemon=True)
+        self.process.start()
+        log.info(f'Started analysis backend process {self.process.pid}')
+    
+
+    def __enter__(self):
+        return self
+    
+
+    def __exit__(self, *args):
+        self.close()
+    
+
+    def analyse(self, newFrame, oldFrame, thresh, **kwargs):
+        '''
+        Analyses the difference between two frames in the worker process
+
+        :param newFrame/oldFrame: new/old frames (h, w) array (int32 grayscale matrix)
+        :param thresh: threshold (0...255) to detect changes between averaged slot frames
+        :param kwargs: further Analysis arguments
+        :returns: Analysis object
+        '''
+        if self.frames is None or self.frames.shape != newFrame.shape:
+            # allocate shared memory for new frame dimensions
+            if self.frames:
+                self.frames.close(unlink=True)
+            self.frames = SharedFrames(newFrame.shape)
+        
+        self.frames.new[...] = newFrame
+        self.frames.old[...] = oldFrame
+        self.conn.send((self.frames.name, self.frames.shape, thresh, kwargs))
+        status, result = self.conn.recv()
+        if status != 'ok':
+            raise RuntimeError(f'Analysis backend failed:\n{result}')
+        
+        return Analysis.fromSummary(result, np.copy(self.frames.diff), np.copy(self.frames.mask))
+    
+
+    def close(self):
+        '''
+        Stops the worker process and releases the shared memory
+        '''
+        if self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(5)
+        if self.frames:
+            self.frames.close(unlink=True)
+            self.frames = None
@@ -0,0 +1,104 @@
+import numpy as np # for array math
+from scipy import ndimage # for image processing
+from functools import lru_cache # for caching footprints
+
+
+@lru_cache(maxsize=None)
+def annulusFootprint(nGuard, nNoise):
+    '''
+    Circular ring footprint around a guard area
+
+    :param nGuard: radius in pixels of the guard area
+    :param nNoise: width in pixels of the ring
+    :returns: (size, size) array (read-only bool mask)
+    '''
+    size = 2*(nGuard+nNoise)+1
+    mask = np.zeros((size, size), dtype=bool)
+    v = np.arange(size)-size//2
+    xx, yy = np.meshgrid(v, v)
+    dist2 = xx**2+yy**2
+    mask[dist2 > nGuard**2] = True
+    mask[dist2 > (nGuard+nNoise)**2] = False
+    mask.flags.writeable = False
+    return mask
+
+
+@lru_cache(maxsize=None)
+def annulusRects(nGuard, nNoise):
+    '''
+    Decomposes the ring footprint into rectangles
+
+    Horizontal line segments of the rows are merged with identical segments in the following rows
+
+    :param nGuard: radius in pixels of the guard area
+    :param nNoise: width in pixels of the ring
+    :returns: tuple of (y0, y1, x0, x1) rectangles relative to the center, 
+        where y0, y1, x0 and x1 are the first and last pixels
+    '''
+    footprint = annulusFootprint(nGuard, nNoise)
+    radius = footprint.shape[0]//2
+    rects = {} # open rectangles by (x0, x1)
+    done = []
+    for iRow, row in enumerate(footprint):
+        y = iRow-radius
+        cols = np.flatnonzero(row)
+        # split columns into contiguous runs
+        spans = [(int(run[0])-radius, int(run[-1])-radius) for run in np.split(cols, np.flatnonzero(np.diff(cols) > 1)+1) if run.size]
+        # close rectangles which do not continue in this row
+        for span in list(rects):
+            if span not in spans:
+                done.append((rects.pop(span), y-1, *span))
+        for span in spans:
+            rects.setdefault(span, y)
+    done.extend((y0, radius, *span) for span, y0 in rects.items())
+    
+    return tuple(sorted(done))
+
+
+def footprintMax(img, nGuard, nNoise):
+    '''
+    Maximum over the ring around each pixel with a generic footprint filter
+
+    :param img: (h, w) array
+    :param nGuard: radius in pixels of the guard area
+    :param nNoise: width in pixels of the ring
+    :returns: (h, w) array of ring maxima
+    '''
+    return ndimage.maximum_filter(img, footprint=annulusFootprint(nGuard, nNoise))
+
+
+def annularMax(img, nGuard, nNoise):
+    '''
+    Maximum over the ring around each pixel, identical to footprintMax
+
+    The ring is decomposed into rectangles, each being a separable running maximum 
+    along the rows and columns (van Herk/Gil-Werman). 
+    Running maxima are computed once per rectangle size and shifted for each rectangle
+
+    :param img: (h, w) array
+    :param nGuard: radius in pixels of the guard area
+    :param nNoise: width in pixels of the ring
+    :returns: (h, w) array of ring maxima
+    '''
+    radius = nGuard+nNoise
+    h, w = img.shape
+    padded = np.pad(img, radius, mode='symmetric') # same border handling as ndimage "reflect" mode
+    rowMax = {} # running maxima along rows by width
+    rectMax = {} # running maxima of rectangles by (height, width)
+    ringMax = None
+    for y0, y1, x0, x1 in annulusRects(nGuard, nNoise):
+        height, width = y1-y0+1, x1-x0+1
+        if (height, width) not in rectMax:
+            if width not in rowMax:
+                rowMax[width] = ndimage.maximum_filter1d(padded, width, axis=1) if width > 1 else padded
+            rectMax[height, width] = ndimage.maximum_filter1d(rowMax[width], height, axis=0) if height > 1 else rowMax[width]
+        # the running maximum window of index i starts at i-size//2
+        top = radius+y0+height//2
+        left = radius+x0+width//2
+        shifted = rectMax[height, width][top:top+h, left:left+w]
+        if ringMax is None:
+            ringMax = np.copy(shifted)
+        else:
+            np.maximum(ringMax, shifted, out=ringMax)
+    
+    return ringMax
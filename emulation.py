@@ -15,8 +15,22 @@ import argparse # for getting arguments when calling script
 parser = argparse.ArgumentParser()
 parser.add_argument('-e', '--emulate', help='Generates artificial frames instead of using the pi camera', action='store_true')
 parser.add_argument('-v', '--video', help='Optional path to a video file to use its frames instead of the pi camera', default='')
+parser.add_argument('-d', '--drop', help='What to do with camera frames when the analysis falls behind', choices=['oldest', 'newest', 'block'], default='oldest')
+parser.add_argument('-q', '--queue', help='Maximum number of camera frames waiting for analysis, at least 1', type=int, default=2)
+parser.add_argument('-b', '--backend', help='Where to run the analysis: in the analysis thread or in a separate process', choices=['thread', 'process'], default='thread')
+parser.add_argument('-t', '--tiles', help='Number of threads to filter tiles of the analysed frames in parallel, 0 to filter at once', type=int, default=0)
+parser.add_argument('-p', '--pyramid', help='Bound the changes per block first and analyse only blocks which can reach the threshold', action='store_true')
+parser.add_argument('-i', '--interval', help='Analyse every x frames instead of once per averaged slot', type=int, default=0)
+parser.add_argument('-j', '--jpeg', help='JPEG encoder library for the stream, auto picks the fastest installed one', choices=['auto', 'simplejpeg', 'turbojpeg', 'cv2', 'pil'], default='auto')
+parser.add_argument('-c', '--chroma', help='Chroma subsampling of colormapped stream images', choices=['444', '422', '420'], default='420')
+parser.add_argument('-s', '--server', help='HTTP server: one thread per client or all clients in one asyncio event loop', choices=['thread', 'asyncio'], default='thread')
+parser.add_argument('-m', '--measure', help='Measures the duration of each pipeline stage and shows percentiles in the infos', action='store_true')
+parser.add_argument('-r', '--records', help='Number of frames kept in the telemetry ring buffer, 0 to disable', type=int, default=10000)
+parser.add_argument('-x', '--trace', help='Number of pipeline spans kept for the Chrome trace at /debug/trace.json, 0 to disable', type=int, default=0)
 # evaluate arguments
 clargs = parser.parse_args()
+if clargs.queue < 1:
+    parser.error('argument -q/--queue: must be at least 1')
 
 emulated = clargs.emulate
 
@@ -35,6 +49,7 @@ class Emulator:
         self.exposure_speed = 1e6/self.fakeFPS
         self.thread = None
         self.stopper = threading.Event()
+        self.rawBuffer = None
     
 
     def __enter__(self):
@@ -83,7 +98,7 @@ class Emulator:
         '''
         Starts a thread with fake image generation
 
-        :param analysis: fake picamera.array.PiYUVAnalysis object
+        :param analysis: picamera.array.PiAnalysisOutput like object
         '''
         self.stopper.clear()
         # start non-blocking image generation
@@ -100,9 +115,29 @@ class Emulator:
 
     def generateImage(self):
         '''
-        :returns: fake image of paper and mirror
+        :returns: raw YUV420 buffer of fake image of paper and mirror
         '''
         raise NotImplementedError('Generation of new fake image must be implemented here')
+    
+
+    def toRawYUV(self, y):
+        '''
+        Packs a luminance matrix into a raw YUV420 buffer like the pi camera does
+
+        Note: The buffer is reused for each frame and the chroma planes are left untouched
+
+        :param y: (h, w) array (uint8 grayscale matrix)
+        :returns: memoryview of raw YUV420 buffer
+        '''
+        fwidth, fheight = raw_resolution(self.resolution)
+        yLen = fwidth*fheight
+        size = yLen+2*(fwidth//2)*(fheight//2)
+        if self.rawBuffer is None or len(self.rawBuffer) != size:
+            self.rawBuffer = np.full(size, 128, dtype=np.uint8) # gray chroma
+        
+        h, w = y.shape
+        self.rawBuffer[:yLen].reshape((fheight, fwidth))[:h, :w] = y
+        return self.rawBuffer.data
 
 
     def _imageGeneration(self, analysis):
@@ -112,8 +147,8 @@ class Emulator:
         period = 1./self.fakeFPS
         tNext = time.time()
         while True:
-            img = self.generateImage() # generate image
-            analysis.analyse(img) # let external analysis process image
+            buf = self.generateImage() # generate image
+            analysis.write(buf) # let external analysis process image
 
             # check if we should stop generating images
             if self.stopper.is_set():
@@ -185,7 +220,7 @@ class ArtificialPiCamera(Emulator):
 
     def generateImage(self):
         '''
-        :returns: fake image of paper and mirror
+        :returns: raw YUV420 buffer of fake image of paper and mirror
         '''
         # make hole
         now = time.time()
@@ -208,9 +243,8 @@ class ArtificialPiCamera(Emulator):
         img *= 255 # denormalize
         img = np.clip(img, 0, 255) # clip
         img = img.astype(np.uint8) # to ints
-        img = np.repeat(img[..., None], 3, axis=2) # copy values to all channels
 
-        return img
+        return self.toRawYUV(img)
 
 
 class VideoPiCamera(Emulator):
@@ -224,7 +258,7 @@ class VideoPiCamera(Emulator):
 
     def generateImage(self):
         '''
-        :returns: video frame image
+        :returns: raw YUV420 buffer of video frame image
         '''
         success, img = self.video.read()
         if not success:
@@ -237,23 +271,46 @@ class VideoPiCamera(Emulator):
         h, w, _ = img.shape
         self.resolution = (w, h)
 
-        # convert to yuv
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2YUV)
-        return img
+        # convert to luminance, which equals the Y channel of YUV
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return self.toRawYUV(img)
 
 
 class PiCamera(VideoPiCamera if clargs.video else ArtificialPiCamera):
     pass
 
 
-class PiYUVAnalysis:
+def raw_resolution(resolution, splitter=False):
+    '''
+    Fake picamera.array.raw_resolution function
+
+    :param resolution: (width, height) in pixels
+    :param splitter: True if frames come from the video port splitter
+    :returns: (width, height) rounded up to the padded frame dimensions of the camera
     '''
-    Fake picamera.array.PiYUVAnalysis class to emulate camera frames
+    width, height = resolution
+    fwidth = (width+15) & ~15 if splitter else (width+31) & ~31
+    fheight = (height+15) & ~15
+    return fwidth, fheight
+
+
+class PiAnalysisOutput:
+    '''
+    Fake picamera.array.PiAnalysisOutput class to emulate camera frames
 
     Note: Works only with a fake PiCamera object
     '''
-    def __init__(self, camera):
+    def __init__(self, camera, size=None):
         self.camera = camera
+        self.size = size
+    
+
+    def write(self, b):
+        return len(b)
+    
+
+    def analyse(self, array):
+        raise NotImplementedError('analyse must be overridden')
     
 
     def __enter__(self):
@@ -262,4 +319,8 @@ class PiYUVAnalysis:
     
 
     def __exit__(self, *args):
+        self.close()
+    
+
+    def close(self):
         pass
\ No newline at end of file
@@ -0,0 +1,177 @@
+import io # for temporary buffer to simulate file for image conversion
+import numpy as np # for array handling
+from PIL import Image # default encoder
+try:
+    import simplejpeg # optional fast libjpeg-turbo encoder
+except ImportError:
+    simplejpeg = None
+try:
+    import turbojpeg # optional fast libjpeg-turbo encoder (PyTurboJPEG)
+except ImportError:
+    turbojpeg = None
+try:
+    import cv2 # optional OpenCV encoder
+except ImportError:
+    cv2 = None
+
+
+subsamplings = ('444', '422', '420') # chroma subsampling of RGB images, grayscale has no chroma
+
+
+class JPEGEncoder:
+    '''
+    Converts uint8 image arrays to JPEG bytes
+
+    Subclasses implement encodeGray and encodeRGB for one library.
+    '''
+    name = None
+    available = False
+
+    def __init__(self, quality=75, subsampling='420'):
+        '''
+        :param quality: default JPEG quality (1...95)
+        :param subsampling: chroma subsampling of RGB images, one of subsamplings
+        '''
+        if subsampling not in subsamplings:
+            raise ValueError(f'Unknown chroma subsampling {subsampling}, use one of {subsamplings}')
+        self.quality = quality
+        self.subsampling = subsampling
+    
+
+    def encode(self, img, quality=None):
+        '''
+        Encodes an image array
+
+        :param img: (h, w) or (h, w, 3) array (uint8 grayscale or RGB image)
+        :param quality: JPEG quality (1...95), None for the default quality of the encoder
+        :returns: JPEG bytes
+        '''
+        quality = self.quality if quality is None else quality
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        if img.ndim == 2:
+            return self.encodeGray(img, quality)
+        return self.encodeRGB(img, quality)
+    
+
+    def encodeGray(self, img, quality):
+        raise NotImplementedError
+    
+
+    def encodeRGB(self, img, quality):
+        raise NotImplementedError
+    
+
+    def __repr__(self):
+        return f'{type(self).__name__}(quality={self.quality}, subsampling={self.subsampling!r})'
+
+
+class PILEncoder(JPEGEncoder):
+    name = 'pil'
+    available = True
+    pilSubsampling = {'444': 0, '422': 1, '420': 2}
+
+    def save(self, im, quality):
+        buffer = io.BytesIO()
+        im.save(buffer, 'jpeg', quality=quality, subsampling=self.pilSubsampling[self.subsampling])
+        return buffer.getvalue()
+    
+
+    def encodeGray(self, img, quality):
+        # wrap the array memory without the generic fromarray conversion
+        return self.save(Image.frombuffer('L', img.shape[::-1], img, 'raw', 'L', 0, 1), quality)
+    
+
+    def encodeRGB(self, img, quality):
+        return self.save(Image.fromarray(img, 'RGB'), quality)
+
+
+class SimpleJPEGEncoder(JPEGEncoder):
+    name = 'simplejpeg'
+    available = simplejpeg is not None
+
+    def encodeGray(self, img, quality):
+        return simplejpeg.encode_jpeg(img[:, :, None], quality, colorspace='GRAY', colorsubsampling='Gray')
+    
+
+    def encodeRGB(self, img, quality):
+        return simplejpeg.encode_jpeg(img, quality, colorspace='RGB', colorsubsampling=self.subsampling)
+
+
+class TurboJPEGEncoder(JPEGEncoder):
+    name = 'turbojpeg'
+    available = turbojpeg is not None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.turbo = turbojpeg.TurboJPEG() # loads libturbojpeg
+        self.turboSubsampling = {
+            '444': turbojpeg.TJSAMP_444, '422': turbojpeg.TJSAMP_422, '420': turbojpeg.TJSAMP_420}[self.subsampling]
+    
+
+    def encodeGray(self, img, quality):
+        return self.turbo.encode(img[:, :, None], quality=quality,
+            pixel_format=turbojpeg.TJPF_GRAY, jpeg_subsample=turbojpeg.TJSAMP_GRAY)
+    
+
+    def encodeRGB(self, img, quality):
+        return self.turbo.encode(img, quality=quality,
+            pixel_format=turbojpeg.TJPF_RGB, jpeg_subsample=self.turboSubsampling)
+
+
+class CV2Encoder(JPEGEncoder):
+    name = 'cv2'
+    available = cv2 is not None
+
+    def imencode(self, img, params):
+        ok, data = cv2.imencode('.jpg', img, params)
+        if not ok:
+            raise RuntimeError('OpenCV failed to encode JPEG')
+        return data.tobytes()
+    
+
+    def encodeGray(self, img, quality):
+        return self.imencode(img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    
+
+    def encodeRGB(self, img, quality):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        if hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'): # OpenCV >= 4.5.5
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, {
+                '444': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+                '422': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+                '420': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420}[self.subsampling]]
+        return self.imencode(img[:, :, ::-1], params) # OpenCV expects BGR
+
+
+# all encoders in order of preference for automatic selection
+encoders = {cls.name: cls for cls in (SimpleJPEGEncoder, TurboJPEGEncoder, CV2Encoder, PILEncoder)}
+
+
+def availableEncoders():
+    '''
+    :returns: list of names of encoders whose library is installed
+    '''
+    return [name for name, cls in encoders.items() if cls.available]
+
+
+def makeEncoder(name='auto', **kwargs):
+    '''
+    Creates a JPEG encoder
+
+    :param name: encoder name in encoders, "auto" for the first usable one, falling back to PIL
+    :param kwargs: quality and subsampling passed to the encoder
+    :returns: JPEGEncoder
+    '''
+    if name != 'auto':
+        cls = encoders[name]
+        if not cls.available:
+            raise ImportError(f'JPEG encoder {name} is not installed')
+        return cls(**kwargs)
+
+    for cls in encoders.values():
+        if cls.available:
+            try:
+                return cls(**kwargs)
+            except (OSError, RuntimeError):
+                continue # library wrapper installed, but shared library missing
+    return PILEncoder(**kwargs)
@@ -0,0 +1,28 @@
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # to import project modules
+import numpy as np # for test frames
+import time # for performance measurement
+from cfar import annularMax, footprintMax # to compare
+
+
+def timeit(func, *args, repeat=5):
+    '''
+    :returns: best duration in seconds of repeated function calls
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter()-startTime)
+    return best
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    # compare speed on typical crop sizes, helper/test_cfar.py checks the results are identical
+    print(f'{"crop":>10} {"footprint":>12} {"annular":>12} {"speed-up":>9}')
+    for size in (200, 400, 800, 1080):
+        img = rng.integers(-50, 50, (size, size)).astype(np.int32)
+        tFootprint = timeit(footprintMax, img, 5, 2)
+        tAnnular = timeit(annularMax, img, 5, 2)
+        print(f'{size:>4}x{size:<5} {tFootprint*1e3:>9.2f} ms {tAnnular*1e3:>9.2f} ms {tFootprint/tAnnular:>8.1f}x')
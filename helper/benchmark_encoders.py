@@ -0,0 +1,67 @@
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # to import project modules
+import io # for decoding
+import numpy as np # for test frames
+from scipy import ndimage # for camera like test frames
+from PIL import Image # to check the encoded images
+import time # for performance measurement
+from encoders import encoders, availableEncoders # to compare
+
+
+def timeit(func, *args, repeat=10):
+    '''
+    :returns: best duration in seconds of repeated function calls
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter()-startTime)
+    return best
+
+
+def colorize(img):
+    '''
+    :returns: (h, w, 3) array (uint8 RGB image) like a colormapped stream image
+    '''
+    return np.stack([img, img//2, 255-img], axis=-1)
+
+
+def testFrame(rng, size):
+    '''
+    :returns: (size, size) array (uint8 grayscale matrix) with smooth content and sensor noise
+    '''
+    img = ndimage.gaussian_filter(rng.uniform(0, 255, (size, size)), size/20)
+    img = (img-img.min())/(np.ptp(img)+1e-9)*200 + rng.normal(0, 3, (size, size)) + 20
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    names = availableEncoders()
+    print(f'Installed encoders: {", ".join(names)}')
+    quality = int(sys.argv[1]) if len(sys.argv) > 1 else 75
+
+    # check every encoder returns a decodable image of the right size and mode
+    for name in names:
+        encoder = encoders[name](quality=quality)
+        for img in (testFrame(rng, 101), colorize(testFrame(rng, 64))):
+            im = Image.open(io.BytesIO(encoder.encode(img)))
+            if im.size != img.shape[1::-1] or len(im.getbands()) != (1 if img.ndim == 2 else 3):
+                sys.exit(f'{name} encoded {img.shape} to {im.size} {im.mode}')
+    print('All encoders produce valid images')
+
+    # compare speed and size on stream sizes: halved preview, crops and full preview
+    for title, color in (('grayscale', False), ('RGB', True)):
+        print(f'\n{title}, quality {quality}')
+        print(f'{"size":>10}' + ''.join(f' {name:>18}' for name in names))
+        for size in (200, 400, 540, 800, 1080):
+            img = testFrame(rng, size)
+            if color:
+                img = colorize(img)
+            cells = []
+            for name in names:
+                encoder = encoders[name](quality=quality)
+                duration = timeit(encoder.encode, img)
+                cells.append(f'{duration*1e3:>6.2f} ms {len(encoder.encode(img))/1e3:>5.0f} kB')
+            print(f'{size:>4}x{size:<5}' + ''.join(f' {cell:>18}' for cell in cells))
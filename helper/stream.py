@@ -1,8 +1,9 @@
-import io
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # to import project modules
 import picamera
 import socketserver
-from threading import Condition
 from http import server
+from hub import FrameHub
 
 
 PAGE="""\
@@ -22,20 +23,16 @@ html, body {margin: 0; padding: 0; height: 100%; width: 100%;}
 
 class StreamingOutput(object):
     def __init__(self):
-        self.frame = None
-        self.buffer = io.BytesIO()
-        self.condition = Condition()
+        self.chunks = [] # parts of the frame being written
+        self.frames = FrameHub() # complete JPEG frames
 
     def write(self, buf):
-        if buf.startswith(b'\xff\xd8'):
-            # New frame, copy the existing buffer's content and notify all
-            # clients it's available
-            self.buffer.truncate()
-            with self.condition:
-                self.frame = self.buffer.getvalue()
-                self.condition.notify_all()
-            self.buffer.seek(0)
-        return self.buffer.write(buf)
+        if buf.startswith(b'\xff\xd8') and self.chunks:
+            # New frame, publish the previous one to all clients
+            self.frames.publish(b''.join(self.chunks))
+            self.chunks = []
+        self.chunks.append(bytes(buf))
+        return len(buf)
 
 
 class StreamingHandler(server.BaseHTTPRequestHandler):
@@ -59,16 +56,15 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
             self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
             self.end_headers()
             try:
-                while True:
-                    with output.condition:
-                        output.condition.wait()
-                        frame = output.frame
-                    self.wfile.write(b'--FRAME\r\n')
-                    self.send_header('Content-Type', 'image/jpeg')
-                    self.send_header('Content-Length', len(frame))
-                    self.end_headers()
-                    self.wfile.write(frame)
-                    self.wfile.write(b'\r\n')
+                with output.frames.subscribe() as cursor:
+                    while True:
+                        frame = cursor.next().data
+                        self.wfile.write(b'--FRAME\r\n')
+                        self.send_header('Content-Type', 'image/jpeg')
+                        self.send_header('Content-Length', len(frame))
+                        self.end_headers()
+                        self.wfile.write(frame)
+                        self.wfile.write(b'\r\n')
             except Exception:
                 pass
         else:
@@ -0,0 +1,25 @@
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # to import project modules
+import numpy as np # for test frames
+from cfar import annularMax, footprintMax # to compare
+
+
+def test_annularMax():
+    '''
+    Checks that the decomposed ring maximum equals the footprint maximum filter 
+    including borders, odd shapes, negative values and dtypes
+    '''
+    rng = np.random.default_rng(0)
+    for nGuard, nNoise in ((5, 2), (1, 1), (3, 4), (8, 3)):
+        for shape in ((1, 1), (7, 30), (101, 64), (300, 257)):
+            for dtype in (np.int16, np.int32, np.float64):
+                img = rng.integers(-300, 300, shape).astype(dtype)
+                result = annularMax(img, nGuard, nNoise)
+                assert result.dtype == img.dtype, f'dtype {result.dtype} instead of {dtype.__name__}'
+                assert np.array_equal(result, footprintMax(img, nGuard, nNoise)), \
+                    f'Mismatch for nGuard={nGuard}, nNoise={nNoise}, shape={shape}, dtype={dtype.__name__}'
+
+
+if __name__ == '__main__':
+    test_annularMax()
+    print('Ring maxima are identical')
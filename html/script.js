@@ -1,4 +1,10 @@
+let socket = null; // open WebSocket carrying frames, events and commands
+
 window.post = function(url, data) {
+    if (socket != null) {
+        socket.send(JSON.stringify({path: url, data: data}));
+        return Promise.resolve();
+    }
     return fetch(url, {method: "POST", body: JSON.stringify(data)});
 }
 
@@ -22,29 +28,97 @@ function fillTargetList() {
 fillTargetList();
 
 
+let pendingSettings = {};
+let settingsTimer = null;
+const settingsDelay = 100; // ms to collect changes before sending them in one request
+
+
 function enterParam(paramElement) {
     // entering values via input elements
     let paramKey = paramElement.name;
     let paramVal = ((paramElement.type == "checkbox") ? paramElement.checked : paramElement.value);
     
-    // send to server
-    post("/setting", {param: paramKey, value: paramVal});
+    // collect rapid changes, only the latest value per parameter is sent
+    pendingSettings[paramKey] = paramVal;
+    if (settingsTimer == null) settingsTimer = setTimeout(sendSettings, settingsDelay);
 }
 
 
-// listen to server side event (server updates un-requested)
-const changeSource = new EventSource("/change");
-changeSource.onmessage = function(event) {
-    const data = JSON.parse(event.data); // parse dictionary
+function sendSettings() {
+    // send collected settings to server
+    settingsTimer = null;
+    const settings = pendingSettings;
+    pendingSettings = {};
+    post("/settings", settings);
+}
+
+
+function parseChange(data) {
     parseSettings(data.settings);
     parseUpdate(data.update);
     parseState(data.state);
     parseRings(data.rings);
-    parseMarks(data.marks);
     parseMarkSize(data.marksize);
+    parseMarks(data.marks);
+    parseMarkDelta(data.markdelta);
 }
 
 
+function showFrame(blob) {
+    // display JPEG of a binary WebSocket message
+    const streamEle = document.getElementById("stream");
+    const oldUrl = streamEle.src;
+    streamEle.src = URL.createObjectURL(blob);
+    if (oldUrl.startsWith("blob:")) URL.revokeObjectURL(oldUrl);
+}
+
+
+function connectStreams() {
+    // pass stream parameters of the page, e.g. "?width=480&quality=60", to the stream
+    const search = window.location.search;
+    if (!("WebSocket" in window)) {
+        connectFallback(search);
+        return;
+    }
+
+    // frames, events and commands over one WebSocket
+    const scheme = (window.location.protocol == "https:") ? "wss://" : "ws://";
+    const ws = new WebSocket(scheme + window.location.host + "/ws" + search);
+    let opened = false;
+    ws.onopen = function() {
+        opened = true;
+        socket = ws;
+    }
+    ws.onmessage = function(event) {
+        if (typeof event.data === "string") {
+            parseChange(JSON.parse(event.data)); // parse dictionary
+        } else {
+            showFrame(event.data);
+        }
+    }
+    ws.onclose = function() {
+        socket = null;
+        if (opened) {
+            setTimeout(connectStreams, 1000); // reconnect
+        } else {
+            connectFallback(search); // WebSocket not available, e.g. blocked by a proxy
+        }
+    }
+}
+
+
+function connectFallback(search) {
+    // MJPEG stream and server sent events (server updates un-requested)
+    document.getElementById("stream").src = "stream.jpg" + search;
+    const changeSource = new EventSource("/change");
+    changeSource.onmessage = function(event) {
+        parseChange(JSON.parse(event.data)); // parse dictionary
+    }
+}
+
+window.addEventListener("DOMContentLoaded", connectStreams);
+
+
 function parseSettings(data) {
     if (data == undefined) return;
 
@@ -156,11 +230,36 @@ function parseRings(data) {
 
 
 let selectedMark = null;
+const marks = new Map(); // mark id: mark, in creation order
+let markSize = null;
 
 function parseMarks(data) {
-    // configure marks
+    // replace all marks
+    if (data == undefined) return;
+
+    marks.clear();
+    for (const mark of data) {
+        marks.set(mark.id, mark);
+    }
+    renderMarks();
+}
+
+
+function parseMarkDelta(data) {
+    // apply added, updated and deleted marks
     if (data == undefined) return;
 
+    for (const mark of data.add.concat(data.update)) {
+        marks.set(mark.id, mark);
+    }
+    for (const id of data.delete) {
+        marks.delete(id);
+    }
+    renderMarks();
+}
+
+
+function renderMarks() {
     // overlay container
     const marksEle = document.getElementById("marks");
     marksEle.innerHTML = "";
@@ -174,9 +273,7 @@ function parseMarks(data) {
     let ringSum = 0;
     let innerSum = 0;
     // insert marks in container in reverse order to have newest at top
-    for (let iMark = data.length-1; iMark >= 0; iMark--) {
-        const mark = data[iMark];
-
+    for (const mark of Array.from(marks.values()).reverse()) {
         // count limited values and innermost rings
         const limValue = Math.min(mark.ring, 10);
         ringSum += limValue;
@@ -190,6 +287,10 @@ function parseMarks(data) {
         const pos = mark.relpos;
         markEle.style.top = pos.top+"%";
         markEle.style.left = pos.left+"%";
+        if (markSize != null) {
+            markEle.style.width = markSize.width+"%";
+            markEle.style.height = markSize.height+"%";
+        }
         // add mark to overlay container
         marksEle.appendChild(markEle);
 
@@ -204,12 +305,12 @@ function parseMarks(data) {
 
         // add listener for selection
         markEle.addEventListener("click", function(){
-            selectMark(iMark, mark.pixpos);
+            selectMark(mark.id, mark.pixpos);
             highlightSelection(markEle);
             highlightSelection(entryEle);
         });
         entryEle.addEventListener("click", function(){
-            selectMark(iMark, mark.pixpos);
+            selectMark(mark.id, mark.pixpos);
             highlightSelection(markEle);
             highlightSelection(entryEle);
         });
@@ -226,6 +327,7 @@ function parseMarkSize(data) {
     if (data == undefined) return;
 
     // configure mark overlay size
+    markSize = data;
     for (const markEle of document.getElementsByClassName("mark")) {
         markEle.style.width = data.width+"%";
         markEle.style.height = data.height+"%";
@@ -233,7 +335,7 @@ function parseMarkSize(data) {
 }
 
 
-function selectMark(markIndex, markPos) {
+function selectMark(markId, markPos) {
     // show selection
     document.getElementById("markselect").style.display = "block";
     // insert current position in input elements for change
@@ -241,7 +343,7 @@ function selectMark(markIndex, markPos) {
     document.getElementById("marktop").value = markPos.top;
     // update object for selected mark
     selectedMark = {
-        index: markIndex, 
+        id: markId, 
         pos: markPos
     }
 }
@@ -265,19 +367,19 @@ function correctMark() {
     // send to server
     post("/mark", {
         action: "correct", 
-        index: selectedMark.index, 
+        id: selectedMark.id, 
         pos: {left: left, top: top}
     });
 }
 
 
 function copyMark() {
-    post("/mark", {action: "copy", index: selectedMark.index});
+    post("/mark", {action: "copy", id: selectedMark.id});
 }
 
 
 function deleteMark() {
-    post("/mark", {action: "delete", index: selectedMark.index});
+    post("/mark", {action: "delete", id: selectedMark.id});
 }
 
 
@@ -285,11 +387,11 @@ function toggleMode(btnElement) {
     // start or stop detecting
     if (btnElement.value === "Start") {
         // starting
-        post("/setting", {param: "mode", value: "start"});
+        post("/settings", {mode: "start"});
         btnElement.value = "Stop"
     } else {
         // stopping
-        post("/setting", {param: "mode", value: "preview"});
+        post("/settings", {mode: "preview"});
         btnElement.value = "Start"
     }
 }
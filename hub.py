@@ -0,0 +1,283 @@
+from threading import Condition # for waking up waiting clients
+from collections import defaultdict, deque, namedtuple # for version counters, message history and frames
+import time # for frame timestamps
+
+
+class Versions:
+    '''
+    Change counters of named topics
+
+    Code changing observable state bumps the counters of the affected topics,
+    a waiting reader wakes up on every change.
+    '''
+    def __init__(self):
+        self.condition = Condition()
+        self.counts = defaultdict(int)
+    
+
+    def bump(self, *topics):
+        '''
+        Marks topics as changed
+
+        :param topics: topic names
+        '''
+        with self.condition:
+            for topic in topics:
+                self.counts[topic] += 1
+            self.condition.notify_all()
+    
+
+    def wait(self, known, timeout=None):
+        '''
+        Waits until a counter differs from the known ones
+
+        :param known: dictionary of topic: version seen by the caller
+        :param timeout: maximum waiting time in seconds, None to wait forever
+        :returns: dictionary of current topic: version
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: any(known.get(t) != v for t, v in self.counts.items()), timeout)
+            return dict(self.counts)
+
+
+class BroadcastHub:
+    '''
+    Sequence of encoded messages shared by all clients
+
+    Every message is built once and sent as the same bytes to all clients.
+    Clients keep a cursor (sequence number of the last message they got).
+    New clients and clients that fell behind the history get a snapshot
+    of the latest message of each topic instead.
+    '''
+    def __init__(self, historySize=64):
+        '''
+        :param historySize: number of messages kept for clients catching up
+        '''
+        self.condition = Condition()
+        self.seq = 0 # sequence number of last message
+        self.history = deque(maxlen=historySize) # (seq, message)
+        self.latest = {} # topic: message replaying the full state of the topic
+        self.subscribers = 0 # number of subscribed clients
+        self.listeners = [] # callbacks called on new messages, must not block
+    
+
+    def publish(self, topic, message, snapshot=None):
+        '''
+        Appends a message and wakes up all clients
+
+        :param topic: topic name
+        :param message: message bytes
+        :param snapshot: message bytes or function returning message bytes 
+            with the full state of the topic if message is incremental, None if message is the full state
+        '''
+        with self.condition:
+            self.seq += 1
+            self.history.append((self.seq, message))
+            self.latest[topic] = message if snapshot is None else snapshot
+            self.condition.notify_all()
+            for listener in self.listeners:
+                listener()
+    
+
+    def read(self, cursor):
+        '''
+        :param cursor: sequence number of the last message of the client, 0 for new clients
+        :returns: new cursor and list of message bytes since cursor,
+            the snapshot of all topics if the client is new or fell behind
+        '''
+        with self.condition:
+            if cursor == self.seq:
+                return cursor, []
+            if cursor == 0 or not self.history or cursor < self.history[0][0]-1:
+                for topic, message in self.latest.items():
+                    if callable(message):
+                        self.latest[topic] = message() # build snapshot once when needed
+                return self.seq, list(self.latest.values())
+            start = cursor - self.history[0][0] + 1
+            return self.seq, [message for _, message in list(self.history)[start:]]
+    
+
+    def wait(self, cursor, timeout=None):
+        '''
+        Waits for messages after cursor
+
+        :param cursor: sequence number of the last message of the client
+        :param timeout: maximum waiting time in seconds, None to wait forever
+        :returns: True if there are new messages
+        '''
+        with self.condition:
+            return self.condition.wait_for(lambda: self.seq != cursor, timeout)
+    
+
+    def subscribe(self):
+        '''
+        Registers a client receiving messages
+
+        :returns: BroadcastCursor starting with the snapshot
+        '''
+        with self.condition:
+            self.subscribers += 1
+        return BroadcastCursor(self)
+    
+
+    def unsubscribe(self):
+        '''
+        Unregisters a client receiving messages
+        '''
+        with self.condition:
+            self.subscribers -= 1
+
+
+class BroadcastCursor:
+    '''
+    Position of a subscriber in a BroadcastHub
+    '''
+    def __init__(self, hub):
+        self.hub = hub
+        self.seq = 0 # sequence number of last received message
+    
+
+    def read(self):
+        '''
+        :returns: list of message bytes since the last read, the snapshot on the first read
+        '''
+        self.seq, messages = self.hub.read(self.seq)
+        return messages
+    
+
+    def wait(self, timeout=None):
+        '''
+        Waits for messages after the last read
+
+        :param timeout: maximum waiting time in seconds, None to wait forever
+        :returns: True if there are new messages
+        '''
+        return self.hub.wait(self.seq, timeout)
+    
+
+    def close(self):
+        self.hub.unsubscribe()
+    
+
+    def __enter__(self):
+        return self
+    
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Frame(namedtuple('Frame', ['seq', 'data', 'time'])):
+    '''
+    Immutable published frame
+
+    seq: sequence number, increasing by one per published frame
+    data: payload shared by all subscribers, e.g. JPEG bytes or a read-only array
+    time: time.monotonic() of publishing
+    '''
+
+
+class FrameHub:
+    '''
+    Latest-frame broadcast
+
+    The producer publishes frames, each subscriber keeps the sequence number of its last frame 
+    and waits for a newer one. Slow subscribers skip frames, no frame is sent twice.
+    '''
+    def __init__(self):
+        self.condition = Condition()
+        self.latest = None # latest Frame
+        self.subscribers = 0 # number of subscribed clients
+        self.listeners = [] # callbacks called in the producer thread on new frames, must not block
+    
+
+    def publish(self, data):
+        '''
+        Replaces the latest frame and wakes up all subscribers
+
+        :param data: payload, must not be changed after publishing
+        :returns: published Frame
+        '''
+        with self.condition:
+            frame = Frame(1 if self.latest is None else self.latest.seq+1, data, time.monotonic())
+            self.latest = frame
+            self.condition.notify_all()
+            for listener in self.listeners:
+                listener()
+        return frame
+    
+
+    def wait(self, cursor, timeout=None):
+        '''
+        Waits for a frame newer than cursor
+
+        :param cursor: sequence number of the last frame of the subscriber, 0 for none
+        :param timeout: maximum waiting time in seconds, None to wait forever
+        :returns: latest Frame or None if there is no newer frame after timeout
+        '''
+        with self.condition:
+            if self.condition.wait_for(lambda: self.latest is not None and self.latest.seq > cursor, timeout):
+                return self.latest
+            return None
+    
+
+    def newer(self, cursor):
+        '''
+        :param cursor: sequence number of the last frame of the subscriber
+        :returns: latest Frame if it is newer than cursor, otherwise None
+        '''
+        frame = self.latest
+        return frame if frame is not None and frame.seq > cursor else None
+    
+
+    def subscribe(self):
+        '''
+        Registers a client receiving frames
+
+        :returns: FrameCursor starting at the next frame
+        '''
+        with self.condition:
+            self.subscribers += 1
+        return FrameCursor(self)
+    
+
+    def unsubscribe(self):
+        '''
+        Unregisters a client receiving frames
+        '''
+        with self.condition:
+            self.subscribers -= 1
+
+
+class FrameCursor:
+    '''
+    Position of a subscriber in a FrameHub
+    '''
+    def __init__(self, hub):
+        self.hub = hub
+        self.seq = 0 # sequence number of last received frame
+    
+
+    def next(self, timeout=None):
+        '''
+        Waits for a frame newer than the last received one
+
+        :param timeout: maximum waiting time in seconds, None to wait forever
+        :returns: Frame or None after timeout
+        '''
+        frame = self.hub.wait(self.seq, timeout)
+        if frame is not None:
+            self.seq = frame.seq
+        return frame
+    
+
+    def close(self):
+        self.hub.unsubscribe()
+    
+
+    def __enter__(self):
+        return self
+    
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,17 +1,24 @@
 import io # for temporary buffer to simulate file for image conversion
 import emulation
 if emulation.emulated:
-    from emulation import PiYUVAnalysis
+    from emulation import PiAnalysisOutput, raw_resolution
 else:
-    from picamera.array import PiYUVAnalysis # to stream frames to numpy arrays
+    from picamera.array import PiAnalysisOutput, raw_resolution # to stream raw frames to numpy arrays
 import numpy as np # for array math
 from scipy import ndimage # for image processing
+from cfar import annularMax # for fast maximum over ring footprint
 from PIL import Image # to convert array to image
+from encoders import makeEncoder # for fast JPEG encoding
+from hub import Versions, FrameHub # for notifying about changed state and new stream frames
+from marks import MarkStore # for marks with stable ids
+from timing import Timings, StageTimes # for durations of pipeline stages
+from telemetry import Telemetry, ResultCode # for per-frame records
+from tracing import Tracer # for per-frame trace events
 import time # for performance measurement
 from enum import Enum # for states
-from collections import deque # for fast ring buffer
+from collections import deque, namedtuple # for fast ring buffer and stream variants
 import logging # for more advanced prints
-from threading import Condition # for notifying when binary image is created
+from threading import Condition, Lock, Thread # for the frame queue, encoding and the analysis worker
 
 
 log = logging.getLogger(f'spotter_{__name__}')
@@ -24,19 +31,239 @@ class State(Enum):
     DETECT = 3
 
 
-class FrameAnalysis(PiYUVAnalysis):
-    def __init__(self, *args, **kwargs):
+class DropPolicy(Enum):
+    OLDEST = 'oldest' # discard the oldest queued frame to make room
+    NEWEST = 'newest' # discard the incoming frame
+    BLOCK = 'block' # let the camera wait until there is room
+
+
+class StreamVariant(namedtuple('StreamVariant', ['width', 'quality', 'color'], defaults=(None, 75, 'gray'))):
+    '''
+    Encoding parameters of a stream requested by clients
+
+    width: maximum image width in pixels, None for the published frame width
+    quality: JPEG quality (1...95)
+    color: name of a colormap in colormaps
+    '''
+    @classmethod
+    def fromQuery(cls, query):
+        '''
+        Creates a variant from URL query parameters, invalid values fall back to the defaults
+
+        :param query: dict of parameter name to list of values like returned by urllib.parse.parse_qs
+        :returns: StreamVariant
+        '''
+        default = cls()
+        try:
+            width = int(query['width'][0])
+            width = width if width > 0 else default.width
+        except (KeyError, ValueError):
+            width = default.width
+        try:
+            quality = min(max(int(query['quality'][0]), 1), 95)
+        except (KeyError, ValueError):
+            quality = default.quality
+        color = query.get('color', [default.color])[0]
+        if color not in colormaps:
+            color = default.color
+        return cls(width, quality, color)
+
+
+def colormapLUT(stops):
+    '''
+    Creates a lookup table for an RGB colormap
+
+    :param stops: list of RGB colors evenly distributed from luminance 0 to 255
+    :returns: (256, 3) array (uint8 RGB colors)
+    '''
+    stops = np.asarray(stops, dtype=float)
+    at = np.linspace(0, 255, len(stops))
+    lum = np.arange(256)
+    return np.stack([np.interp(lum, at, stops[:, c]) for c in range(3)], axis=-1).round().astype(np.uint8)
+
+
+# stream colormaps, None for plain grayscale
+colormaps = {
+    'gray': None,
+    'heat': colormapLUT([(0, 0, 0), (128, 0, 0), (255, 64, 0), (255, 200, 0), (255, 255, 255)]),
+    'jet': colormapLUT([(0, 0, 128), (0, 0, 255), (0, 255, 255), (255, 255, 0), (255, 0, 0), (128, 0, 0)]),
+}
+
+
+def downscale(img, factor):
+    '''
+    Shrinks an image by averaging factor x factor pixel blocks, 
+    remaining rows and columns are cut
+
+    :param img: (h, w) array (uint8 grayscale matrix)
+    :param factor: integer reduction factor
+    :returns: (h//factor, w//factor) array (uint8 grayscale matrix)
+    '''
+    if factor <= 1:
+        return img
+    h, w = img.shape[0]//factor, img.shape[1]//factor
+    blocks = img[:h*factor, :w*factor].reshape(h, factor, w, factor)
+    sums = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    return ((sums + factor*factor//2)//(factor*factor)).astype(np.uint8)
+
+
+class FrameQueue:
+    '''
+    Bounded frame buffer between camera capture and analysis
+    '''
+    def __init__(self, maxSize=2, policy=DropPolicy.OLDEST):
+        '''
+        :param maxSize: maximum number of queued frames, at least 1
+        :param policy: DropPolicy what to do with frames when the queue is full
+        '''
+        if maxSize < 1:
+            raise ValueError(f'Frame queue size must be at least 1, got {maxSize}')
+        self.maxSize = maxSize
+        self.policy = policy
+        self.frames = deque()
+        self.condition = Condition()
+        self.added = 0 # number of frames offered by the camera
+        self.dropped = 0 # number of frames discarded because of a full queue
+        self.closed = False
+    
+
+    def put(self, frame):
+        '''
+        Adds a frame to the queue according to the drop policy
+
+        :param frame: (capture time, (h, w) array (uint8 grayscale matrix)) or 
+            function returning it, only called if the frame is not dropped right away
+        :returns: True if the frame was queued, False if it was dropped
+        '''
+        with self.condition:
+            self.added += 1
+            if self.policy == DropPolicy.NEWEST and len(self.frames) >= self.maxSize:
+                self.dropped += 1
+                return False
+        if callable(frame):
+            # outside the lock, the single camera thread only adds frames
+            frame = frame()
+        
+        with self.condition:
+            if len(self.frames) >= self.maxSize:
+                if self.policy == DropPolicy.BLOCK:
+                    self.condition.wait_for(lambda: self.closed or len(self.frames) < self.maxSize)
+                elif self.policy == DropPolicy.OLDEST:
+                    self.frames.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+            if self.closed:
+                return False
+            
+            self.frames.append(frame)
+            self.condition.notify_all()
+            return True
+    
+
+    def get(self, timeout=None):
+        '''
+        Takes the oldest frame from the queue
+
+        :param timeout: maximum waiting time in seconds or None to wait forever
+        :returns: (capture time, (h, w) array (uint8 grayscale matrix)) or None if there was no frame
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.closed or self.frames, timeout) or self.closed:
+                return None
+            frame = self.frames.popleft()
+            self.condition.notify_all() # wake up blocked camera
+            return frame
+    
+
+    def close(self):
+        '''
+        Discards queued frames and releases all waiting threads
+        '''
+        with self.condition:
+            self.closed = True
+            self.frames.clear()
+            self.condition.notify_all()
+    
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def yPlane(data, resolution):
+    '''
+    Gets the luminance plane of a raw YUV420 frame without copying
+
+    :param data: bytes-like raw YUV420 frame, 
+        where the width is padded to a multiple of 32 and the height to a multiple of 16 pixels
+    :param resolution: (width, height) in pixels of the frame
+    :returns: (h, w) array view on data (uint8 grayscale matrix)
+    '''
+    width, height = resolution
+    fwidth, fheight = raw_resolution(resolution)
+    yLen = fwidth*fheight
+    if len(data) != yLen+2*(fwidth//2)*(fheight//2):
+        raise ValueError(f'Incorrect buffer length for resolution {width}x{height}')
+    
+    y = np.frombuffer(data, dtype=np.uint8, count=yLen).reshape((fheight, fwidth))
+    return y[:height, :width]
+
+
+class PiYAnalysis(PiAnalysisOutput):
+    '''
+    Passes only the luminance of raw YUV420 camera frames to the analysis
+
+    Unlike picamera.array.PiYUVAnalysis, the chroma planes are neither upsampled nor copied
+    '''
+    def write(self, b):
+        result = super().write(b)
+        self.analyse(yPlane(b, self.size or self.camera.resolution))
+        return result
+
+
+class FrameAnalysis(PiYAnalysis):
+    def __init__(self, *args, queueSize=2, dropPolicy=DropPolicy.OLDEST, **kwargs):
+        '''
+        :param queueSize: maximum number of frames waiting for analysis
+        :param dropPolicy: DropPolicy when the analysis cannot keep up with the camera
+        '''
         super().__init__(*args, **kwargs)
         # general
+        self.versions = Versions() # change counters of settings, update, state, rings and marks
         self.frameCnt = 0
         self.streamDims = self.camera.resolution # width, height in pixels of current background
-        self.streamImage = bytes()
-        self.buffer = io.BytesIO()
-        self.condition = Condition()
-        self.lowPreviewRes = True # cutting preview stream image resolution to save time
+        self.frames = FrameHub() # stream frames (array, reduction factor for variants without width), encoded on request
+        self.streamCache = {} # StreamVariant: [lock, stream frame count, image bytes]
+        self.maxStreamVariants = 8 # number of cached variants, least recently added are dropped
+        self.streamEncodedSeq = 0 # sequence number of latest encoded frame in any variant
+        self.encodeCnt = 0
+        self.skippedEncodes = 0
+        self.encodedBytes = 0 # total size of encoded stream images
+        self.encodeSeconds = 0. # total time converting and encoding stream images
+        self.encodeLock = Lock()
+        self.encoder = makeEncoder() # JPEGEncoder for stream images
+        self.lowPreviewRes = True # halving default preview stream resolution to save time
         self.procTime = 0.
+        self.timings = Timings() # durations of pipeline stages, enable to measure
+        self.tracer = Tracer() # trace events of pipeline stages, enable to record
+        self.timings.tracer = self.tracer
+        self.telemetry = Telemetry() # records of the last frames, None to disable
+        self.analysisTime = 0. # duration of last analysis
+        self.rateWindow = 10. # seconds over which completed analyses are counted for the throughput
+        self.analysisEnds = deque() # time.perf_counter() of the analyses completed within rateWindow
+        self.threshRetries = 0 # total number of threshold increases by analyses
+        self.changeGate = True # skip analyses when no change can reach the threshold
+        self.pyramid = False # analyse only blocks which can reach the threshold
+        self.fullAnalyses = 0
+        self.skippedAnalyses = 0
+        self.backend = None # object with analyse method like ProcessBackend, None to analyse in this thread
+        self.tilePool = None # optional executor to filter tiles in parallel when analysing in this thread
         self.showDiff = False # show amplified diff instead of the camera frames
-        self.state = State.PREVIEW # do not average and detect changes yet
+        self._state = State.PREVIEW # do not average and detect changes yet
+        self.pendingSettings = {} # setting name: latest requested value, applied by the analysis worker
+        self.settingsLock = Lock()
+        self.settingsHandler = None # function applying a dictionary of settings in the analysis worker
 
         # mirror detection related
         self.mirrorTolerance = 5 # tolerance beyond center luminance range to find mirror pixels
@@ -52,12 +279,74 @@ class FrameAnalysis(PiYUVAnalysis):
         # slot related
         self.maxSlots = 3 # number of slots
         self.nSlotFrames = 10 # number of frames to average
+        self.analysisInterval = None # analyse every x frames when slots are filled, None for every new slot
 
         # hole detection related
         self.thresh = 5 # hole detection sensitivity
         self.maxHoleSize = 20 # maximum expected hole size in width or height pixels
+        self.marks = MarkStore(onChange=lambda: self.versions.bump('marks')) # detected holes
 
         self.reset()
+
+        # decouple analysis from camera thread
+        self.queue = FrameQueue(queueSize, dropPolicy)
+        self.worker = Thread(target=self.processFrames, name='analysis', daemon=True)
+        self.worker.start()
+    
+
+    def close(self):
+        '''
+        Stops the analysis worker
+        '''
+        self.queue.close()
+        if self.worker.is_alive():
+            self.worker.join()
+        if self.backend:
+            self.backend.close()
+        if self.tilePool:
+            self.tilePool.shutdown()
+        super().close()
+    
+
+    @property
+    def capturedFrames(self):
+        '''
+        :returns: number of frames delivered by the camera
+        '''
+        return self.queue.added
+    
+
+    @property
+    def droppedFrames(self):
+        '''
+        :returns: number of frames which were not analysed because the analysis was too slow
+        '''
+        return self.queue.dropped
+    
+
+    @property
+    def analysisRate(self):
+        '''
+        :returns: number of analyses per second completed within the last rateWindow seconds
+        '''
+        now = time.perf_counter()
+        ends = [end for end in list(self.analysisEnds) if end >= now-self.rateWindow] # copy, the analysis thread appends
+        if len(ends) < 2:
+            return 0.
+        return (len(ends)-1)/(ends[-1]-ends[0])
+    
+
+    @property
+    def state(self):
+        return self._state
+    
+
+    @state.setter
+    def state(self, state):
+        if state == self._state:
+            return # assigned on every analysis, nothing changes
+        self._state = state
+        self.versions.bump('state', 'settings', 'rings', 'marks') # mode, geometry and marks depend on state
     
 
     def reset(self):
@@ -65,32 +354,87 @@ class FrameAnalysis(PiYUVAnalysis):
         Resets analysis results
         '''
         log.debug('Resetting analysis results and marks')
-        self.slot = Slot()
-        self.slots = deque(maxlen=self.maxSlots)
+        self.slots = None # allocated with first cropped frame
         self.analysis = None # last analysis
         self.detected = []
-        self.marks = []
+        self.marks.clear()
     
 
     def analyse(self, img):
         '''
         Event fired for each new image coming from camera recording
+
+        Only copies the luminance to the analysis queue to keep the camera thread free, 
+        nothing is copied if the frame is dropped anyway
+
+        :param img: (h, w) array view (uint8 luminance of the camera frame)
         '''
-        startTime = time.perf_counter()
-        self.frameCnt += 1
+        self.tracer.annotate(capture=self.queue.added+1)
+        captureTime = time.time()
+        def copyFrame():
+            # make square
+            with self.timings.span('copy'):
+                halfH, halfW = img.shape[0]//2, img.shape[1]//2
+                return captureTime, np.copy(img[:, halfW-halfH:halfW+halfH])
+        
+        self.queue.put(copyFrame) # not copied if the queue drops new frames
+    
+
+    def requestSettings(self, settings):
+        '''
+        Queues settings for the analysis worker, 
+        a newer value replaces the pending value of the same setting
+
+        :param settings: dictionary of setting name: value
+        '''
+        with self.settingsLock:
+            self.pendingSettings.update(settings)
+    
+
+    def applyPendingSettings(self):
+        '''
+        Applies the latest requested value of each pending setting, called by the analysis worker before each frame
+        '''
+        with self.settingsLock:
+            settings, self.pendingSettings = self.pendingSettings, {}
+        if settings and self.settingsHandler is not None:
+            self.settingsHandler(settings)
+    
+
+    def processFrames(self):
+        '''
+        Analysis worker loop consuming queued frames
+        '''
+        while not self.queue.closed:
+            queued = self.queue.get(timeout=0.5)
+            try:
+                self.applyPendingSettings()
+            except Exception:
+                log.exception('Failed to apply settings')
+            if queued is None:
+                continue
+            try:
+                self.process(*queued)
+            except Exception:
+                log.exception('Failed to process frame')
+    
 
-        # convert camera image to grayscale frame matrix
-        frame = img[:, :, 0] # get luminance channel of YUV
+    def process(self, captureTime, frame):
+        '''
+        Analyses a frame from the queue
 
-        # make square
-        halfH, halfW = frame.shape[0]//2, frame.shape[1]//2
-        frame = frame[:, halfW-halfH:halfW+halfH]
+        :param captureTime: time.time() when the frame arrived from the camera
+        :param frame: (h, w) array (uint8 grayscale matrix) of the square camera frame
+        '''
+        startTime = time.perf_counter()
+        self.frameCnt += 1
+        self.tracer.annotate(frame=self.frameCnt)
+        analysis = None # analysis of this frame
 
         if self.state == State.PREVIEW:
             # in preview state, output uncropped frame
             self.streamDims = frame.shape[::-1]
-            prev = frame[::2, ::2] if self.lowPreviewRes else frame
-            self.makeStreamImage(prev)
+            self.makeStreamImage(frame, reduce=2 if self.lowPreviewRes else 1)
         elif self.state == State.START:
             self.reset() # reset analysis results and marks
             
@@ -118,56 +462,123 @@ class FrameAnalysis(PiYUVAnalysis):
         else:
             # COLLECT or DETECT state
             # crop frame
-            frame = self.cropBounds.crop(frame)
-            frame = frame.astype(np.int16, copy=False)
+            with self.timings.span('crop'):
+                frame = self.cropBounds.crop(frame)
             
-            # add frame to current slot
-            log.debug(f'Adding frame {self.slot.length+1}/{self.nSlotFrames} to slot')
-            self.slot.add(frame)
-            if self.slot.length >= self.nSlotFrames:
-                # add current slot to slots
-                log.debug('Cycling slot')
-                if self.cycleSlots(self.slot):
-                    # all slots filles and ready for analysis
-                    self.streamDims = frame.shape[::-1]
-                    self.state = State.DETECT
-                    
-                    # analyse for differences between newest and oldest slot
-                    log.debug('Comparing newest to oldest slot')
-                    self.analysis = Analysis(self.slots[0].mean, self.slots[-1].mean, self.thresh, maxSize=self.maxHoleSize)
-                    display = np.copy(np.abs(self.analysis.diff*30) if self.showDiff else self.slots[0].mean)
-                    if self.analysis.valid:
-                        holePoint = self.analysis.rect.center
+            # (re)allocate slots for new crop or averaging
+            if self.slots is None or self.slots.shape != frame.shape or self.slots.nSlotFrames != self.nSlotFrames:
+                log.debug(f'Allocating {self.maxSlots} slots with {self.nSlotFrames} frames')
+                self.slots = SlotBuffer(frame.shape, self.maxSlots, self.nSlotFrames)
+            
+            # add frame to slots
+            with self.timings.span('slots'):
+                self.slots.add(frame)
+            interval = self.analysisInterval or self.nSlotFrames
+            if self.slots.full and (self.slots.count-self.slots.capacity)%interval == 0:
+                # all slots filled and ready for analysis
+                self.streamDims = frame.shape[::-1]
+                self.state = State.DETECT
+                
+                # analyse for differences between newest and oldest slot
+                log.debug('Comparing newest to oldest slot')
+                newMean = self.slots.newMean
+                analysisStart = time.perf_counter()
+                gate = self.changeGate and not self.showDiff # diff is needed for display
+                timed = self.timings.enabled
+                if self.backend:
+                    self.analysis = self.backend.analyse(newMean, self.slots.oldMean, self.thresh, maxSize=self.maxHoleSize, gate=gate, pyramid=self.pyramid, timed=timed)
+                else:
+                    self.analysis = Analysis(newMean, self.slots.oldMean, self.thresh, maxSize=self.maxHoleSize, pool=self.tilePool, gate=gate, pyramid=self.pyramid, timed=timed)
+                analysis = self.analysis
+                analysisEnd = time.perf_counter()
+                self.analysisTime = analysisEnd-analysisStart
+                self.analysisEnds.append(analysisEnd)
+                while self.analysisEnds[0] < analysisEnd-self.rateWindow:
+                    self.analysisEnds.popleft()
+                self.tracer.complete('analysis', analysisStart, self.analysisTime)
+                if timed:
+                    self.timings.record('analysis', self.analysisTime)
+                    self.timings.recordAll(self.analysis.stageTimes, 'analysis.')
+                self.threshRetries += self.analysis.tries
+                if self.analysis.skipped:
+                    self.skippedAnalyses += 1
+                else:
+                    self.fullAnalyses += 1
+                with self.timings.span('display'):
+                    display = np.copy(np.abs(self.analysis.diff*30) if self.showDiff else newMean)
+                    display[self.analysis.mask] = 255
+                if self.analysis.valid:
+                    for hit in self.analysis.hits:
+                        holePoint = hit.center
                         # check if detected hole is not already there
                         if self.isDoubleMark(holePoint):
                             log.warning(f'{holePoint} is probably a duplicate and will not be marked')
+                        elif self.isDoubleMark(holePoint, self.maxHoleSize//2, self.detected):
+                            log.debug(f'{holePoint} was already detected')
                         else:
                             # add detection to mark consideration
                             log.info(f'Valid change detected at {holePoint}')
                             self.detected.append(holePoint)
-                    else:
-                        # add mark for detection
-                        if self.detected:
-                            log.debug('Adding change detection mark')
-                            self.marks.append(self.detected[0])
-                        self.detected = []
-                    
-                    # debug display
-                    display[self.analysis.mask] = 255
-                    self.makeStreamImage(display)
+                else:
+                    # add marks for first detection of each hole
+                    if self.detected:
+                        log.debug(f'Adding {len(self.detected)} change detection marks')
+                        self.marks.extend(self.detected)
+                    self.detected = []
+                
+                self.makeStreamImage(display)
         
         self.procTime = time.perf_counter()-startTime
+        self.tracer.complete('process', startTime, self.procTime)
+        if self.timings.enabled:
+            self.timings.record('process', self.procTime)
+        if self.telemetry is not None:
+            self.recordTelemetry(captureTime, frame, analysis)
+        self.versions.bump('update')
+    
+
+    def recordTelemetry(self, captureTime, frame, analysis):
+        '''
+        Adds the record of a processed frame to self.telemetry
+
+        :param captureTime: time.time() when the frame arrived from the camera
+        :param frame: (h, w) array (uint8 grayscale matrix) of the processed, in detection states cropped frame
+        :param analysis: Analysis of this frame, None if there was none
+        '''
+        fields = {
+            'time': captureTime, 
+            'frame': self.frameCnt, 
+            'state': self.state.value, 
+            'thresh': self.thresh, 
+            'luminance': frame[::4, ::4].mean(), # sparse mean is accurate enough
+            'process': self.procTime*1e3
+        }
+        if analysis is not None:
+            if analysis.skipped:
+                result = ResultCode.SKIPPED
+            elif analysis.valid:
+                result = ResultCode.VALID
+            elif analysis.changed > 0:
+                result = ResultCode.TOO_MUCH
+            else:
+                result = ResultCode.NO_CHANGE
+            fields.update(result=result, thresh=analysis.thresh, changed=analysis.changed, analysis=self.analysisTime*1e3)
+            fields.update({stage: seconds*1e3 for stage, seconds in analysis.stageTimes.items() if stage in self.telemetry.stages})
+        self.telemetry.record(**fields)
     
 
-    def isDoubleMark(self, mark, tolerance=3):
+    def isDoubleMark(self, mark, tolerance=3, marks=None):
         '''
         Checks if mark is already close to other marks
 
         :param mark: (x, y) center of mark
         :param tolerance: x/y max distance tolerance to other mark to count as double
+        :param marks: iterable of (x, y) marks to check, None for the MarkStore self.marks
         :returns: True if mark is already there or False if unique
         '''
-        for otherMark in self.marks:
+        if marks is None:
+            return self.marks.isDouble(mark, tolerance)
+        for otherMark in marks:
             if abs(mark[0]-otherMark[0]) <= tolerance and abs(mark[1]-otherMark[1]) <= tolerance:
                 return True
         
@@ -227,89 +638,197 @@ class FrameAnalysis(PiYUVAnalysis):
             return None
     
 
-    def cycleSlots(self, slot):
+    @property
+    def progress(self):
         '''
-        Pushes new slot into buffer
-
-        :param slot: Slot object
-        :returns: True if all slots filled, False otherwise
+        :returns: ratio (0...1) of filled slots or of frames until next analysis, 
+            None if not collecting frames
         '''
-        self.slots.appendleft(slot) # insert current slot
-        self.slot = Slot() # reset current slot
-        # check if full
-        if len(self.slots) == self.slots.maxlen:
-            return True
-        else:
-            return False
+        if self.state not in (State.COLLECT, State.DETECT) or self.slots is None:
+            return None
+        
+        if not self.slots.full:
+            return self.slots.length/self.slots.capacity
+        interval = self.analysisInterval or self.nSlotFrames
+        return ((self.slots.count-self.slots.capacity)%interval)/interval
     
 
-    def imgArrayToImgBytes(self, img, filetype='jpeg'):
+    def imgArrayToImgBytes(self, img, filetype='jpeg', **options):
         '''
         Converts an image array to image bytes
 
         :param img: (h, w, 3) or (h, w) array (uint8 grayscale or RGB image)
         :param filetype: image format string, e.g. "png", "gif", ... default "jpeg"
+        :param options: format specific PIL save options, only quality for JPEG
         :returns: image file bytes
         '''
-        self.buffer.seek(0)
+        if filetype == 'jpeg':
+            return self.encoder.encode(img, quality=options.get('quality'))
+        buffer = io.BytesIO() # own buffer, variants may be encoded concurrently
         im = Image.fromarray(img) # create image object
-        im.save(self.buffer, filetype) # write image to buffer
-        return self.buffer.getvalue() # get buffer bytes
+        im.save(buffer, filetype, **options) # write image to buffer
+        return buffer.getvalue() # get buffer bytes
     
 
-    def makeStreamImage(self, frame):
+    def makeStreamImage(self, frame, reduce=1):
         '''
-        Converts a grayscale frame to bytes of its image
+        Publishes a grayscale frame for the stream
 
-        :param frame: (h, w) array (int16 grayscale matrix)
+        Encoding is deferred until a stream client requests the image
+
+        :param frame: (h, w) array (int grayscale matrix), not changed afterwards
+        :param reduce: downscaling factor for variants without requested width
         '''
-        img = frame.astype(np.uint8)
-        with self.condition:
-            self.streamImage = self.imgArrayToImgBytes(img)
-            self.condition.notify_all()
+        latest = self.frames.latest
+        if latest is not None and self.streamEncodedSeq != latest.seq:
+            self.skippedEncodes += 1 # nobody wanted last frame
+        frame.flags.writeable = False # shared by all encoding threads
+        self.frames.publish((frame, reduce))
+    
 
+    def encodeStreamFrame(self, frame, reduce, variant):
+        '''
+        Converts a stream frame to image bytes of a variant
 
-class Slot:
+        :param frame: (h, w) array (int grayscale matrix)
+        :param reduce: downscaling factor if variant has no width
+        :param variant: StreamVariant
+        :returns: JPEG bytes
+        '''
+        with self.timings.span('stream'):
+            img = frame.astype(np.uint8)
+            if variant.width is not None:
+                reduce = -(-img.shape[1]//variant.width) # ceil, not wider than requested
+            img = downscale(img, reduce)
+            lut = colormaps[variant.color]
+            if lut is not None:
+                img = lut[img]
+        with self.timings.span('encode'):
+            return self.imgArrayToImgBytes(img, quality=variant.quality)
+    
+
+    def streamImageVariant(self, variant, frame=None):
+        '''
+        Returns a stream frame as image of a variant
+
+        Each variant is encoded at most once per frame and the bytes are shared by all its clients, 
+        different variants are encoded concurrently
+
+        :param variant: StreamVariant
+        :param frame: Frame of self.frames, None for the latest
+        :returns: sequence number of the encoded frame (newer than frame if already encoded) and image bytes
+        '''
+        frame = self.frames.latest if frame is None else frame
+        with self.encodeLock:
+            entry = self.streamCache.get(variant)
+            if entry is None:
+                if len(self.streamCache) >= self.maxStreamVariants:
+                    del self.streamCache[next(iter(self.streamCache))]
+                entry = self.streamCache[variant] = [Lock(), 0, bytes()]
+        with entry[0]:
+            if frame is not None and entry[1] < frame.seq:
+                startTime = time.perf_counter()
+                self.tracer.annotate(stream=frame.seq)
+                entry[2] = self.encodeStreamFrame(*frame.data, variant)
+                entry[1] = frame.seq
+                with self.encodeLock:
+                    self.encodeCnt += 1
+                    self.encodedBytes += len(entry[2])
+                    self.encodeSeconds += time.perf_counter()-startTime
+                    self.streamEncodedSeq = max(self.streamEncodedSeq, frame.seq)
+            return entry[1], entry[2]
+    
+
+    @property
+    def streamImage(self):
+        '''
+        :returns: image bytes of latest stream frame in default variant
+        '''
+        return self.streamImageVariant(StreamVariant())[1]
+
+
+class SlotBuffer:
     '''
-    Averages multiple frames
+    Ring buffer of the latest frames with rolling sums of the newest and the oldest slot
+
+    Each slot averages nSlotFrames consecutive frames. 
+    Adding a frame updates both sums in place, independent of the number of frames.
     '''
-    def __init__(self):
-        self.nFrames = 0
-        self.sum = None
-        self._mean = None
+    def __init__(self, shape, nSlots, nSlotFrames):
+        '''
+        :param shape: (h, w) of the frames
+        :param nSlots: number of slots in the buffer
+        :param nSlotFrames: number of frames per slot
+        '''
+        self.nSlotFrames = nSlotFrames
+        self.capacity = nSlots*nSlotFrames
+        self.frames = np.zeros((self.capacity, *shape), dtype=np.uint8)
+        self.newSum = np.zeros(shape, dtype=np.int32)
+        self.oldSum = np.zeros(shape, dtype=np.int32)
+        self.count = 0
     
 
     def add(self, frame):
         '''
-        Adds a frame to the slot
+        Adds a frame, replacing the oldest one
 
-        :param frame: (h, w) array (int16 grayscale matrix)
+        :param frame: (h, w) array (uint8 grayscale matrix)
         '''
-        if self.nFrames <= 0:
-            self.sum = frame
-        else:
-            self.sum += frame
+        n = self.nSlotFrames
+        i = self.count%self.capacity # position of oldest frame
+        # remove frames leaving the slots before overwriting
+        if self.count >= self.capacity:
+            self.oldSum -= self.frames[i]
+        if self.count >= n:
+            self.newSum -= self.frames[(i-n)%self.capacity]
+        
+        self.frames[i] = frame
+        self.newSum += frame
+        # frame entering oldest slot
+        if self.count >= self.capacity-n:
+            self.oldSum += self.frames[(i+n)%self.capacity]
         
-        self.nFrames += 1
+        self.count += 1
+    
+
+    @property
+    def shape(self):
+        '''
+        :returns: (h, w) of the frames
+        '''
+        return self.newSum.shape
     
 
     @property
     def length(self):
         '''
-        :returns: current number of accumulated frames
+        :returns: current number of buffered frames
         '''
-        return self.nFrames
+        return min(self.count, self.capacity)
     
 
     @property
-    def mean(self):
+    def full(self):
         '''
-        :returns: average value of each pixel over accumulated frames
+        :returns: True if all slots are filled
         '''
-        if self._mean is None:
-            self._mean = self.sum//self.nFrames
-        
-        return self._mean
+        return self.count >= self.capacity
+    
+
+    @property
+    def newMean(self):
+        '''
+        :returns: average value of each pixel over the newest slot
+        '''
+        return self.newSum//self.nSlotFrames
+    
+
+    @property
+    def oldMean(self):
+        '''
+        :returns: average value of each pixel over the oldest slot
+        '''
+        return self.oldSum//self.nSlotFrames
 
 
 class Rect:
@@ -433,32 +952,77 @@ class Analysis:
     '''
     Analysis between slots
     '''
-    def __init__(self, newFrame, oldFrame, thresh, minSize=2, maxSize=20, maxSquareErr=0.2):
+    sigma = 1 # standard deviation of gaussian filter in pixels
+    truncate = 4. # gaussian filter radius in standard deviations
+    nGuard = 5 # radius in pixels of spot for CFAR
+    nNoise = 2 # width in pixels of noise ring for CFAR
+    maxWindowCost = 0.5 # ratio of the diff above which pyramid windows are not worth it
+    windowOverhead = 1000 # cost in pixels of filtering one more window
+
+    def __init__(self, newFrame, oldFrame, thresh, minSize=2, maxSize=20, maxSquareErr=0.2, pool=None, tileSize=256, gate=False, gateBlock=8, pyramid=False, timed=False):
         '''
-        :param newFrame/oldFrame: new/old frames (h, w) array (int16 grayscale matrix)
+        :param newFrame/oldFrame: new/old frames (h, w) array (int32 grayscale matrix)
         :param thresh: threshold (0...255) to detect changes between averaged slot frames
         :param minSize: minimum width/height of change mask
         :param maxSize: maximum width/height of change mask
         :param maxSquareErr: maximum ratio deviation from square of change mask
+        :param pool: optional concurrent.futures executor to filter tiles in parallel
+        :param tileSize: width/height in pixels of tiles when filtering in parallel
+        :param gate: True to skip the CFAR and thresholding when no pixel can reach the threshold
+        :param gateBlock: width/height in pixels of blocks to estimate the possible change
+        :param pyramid: True to bound the highlighted diff per block first 
+            and highlight only blocks which can reach the threshold, 
+            with blocks sized by the maximum change size
+        :param timed: True to measure the durations of the stages in self.stageTimes
         '''
+        self.stageTimes = StageTimes(timed)
         self.valid = False
         self.thresh = thresh
         self.minSize = minSize
         self.maxSize = maxSize
         self.maxSquareErr = maxSquareErr
+        self.hits = []
+        self.tries = 0
+        self.changed = 0 # number of pixels at or above the threshold
         
-        self.diff = oldFrame-newFrame
-        self.diff = ndimage.gaussian_filter(self.diff, 1) # to eliminate outliers
-        self.diff = self.circMaxCFAR(self.diff)
-        self.diff = np.maximum(self.diff, 0)
-        self.analyzeDiff()
+        span = self.stageTimes.span
+        with span('diff'):
+            diff = oldFrame-newFrame
+        with span('smooth'):
+            diff = self.filterTiles(self.smoothDiff, diff, self.smoothHalo, pool, tileSize)
+        if pyramid:
+            # filter only blocks which can reach the threshold
+            block = self.pyramidBlock(maxSize)
+            with span('gate'):
+                candidates = self.blockBounds(diff, block) >= self.thresh
+            self.skipped = not candidates.any()
+            if not self.skipped:
+                with span('pyramid'):
+                    self.diff = self.filterCandidates(diff, candidates, block, pool)
+                if self.diff is None:
+                    # too many candidates, filtering at once is faster
+                    with span('cfar'):
+                        self.diff = self.filterTiles(self.highlightDiff, diff, self.nGuard+self.nNoise, pool, tileSize)
+        else:
+            with span('gate'):
+                self.skipped = gate and self.changeBound(diff, gateBlock) < self.thresh
+            if not self.skipped:
+                with span('cfar'):
+                    self.diff = self.filterTiles(self.highlightDiff, diff, self.nGuard+self.nNoise, pool, tileSize)
         
-        self.tries = 0
-        while (self.result == 'too much change'):
-            self.tries += 1
-            # check for too much movement and try to resolve
-            self.thresh += 2
-            log.info(f'Increasing threshold to {self.thresh}')
+        if self.skipped:
+            # nothing can exceed threshold
+            self.diff = np.zeros(diff.shape, dtype=diff.dtype)
+            self.mask = np.zeros(diff.shape, dtype=bool)
+            self.result = 'no change'
+            return
+        
+        # resolve too much movement by increasing the threshold
+        with span('threshold'):
+            self.tries = self.findThresh()
+        if self.tries > 0:
+            log.info(f'Increased threshold to {self.thresh}')
+        with span('label'):
             self.analyzeDiff()
         
         if self.valid:
@@ -468,6 +1032,169 @@ class Analysis:
                 self.result = f'Suggested threshold: {int(minThresh)+1}'
     
 
+    def smoothDiff(self, diff):
+        '''
+        Smoothes the difference between frames to eliminate outliers
+
+        :param diff: (h, w) array (int32 difference matrix)
+        :returns: smoothed diff
+        '''
+        return ndimage.gaussian_filter(diff, self.sigma, truncate=self.truncate)
+    
+
+    @property
+    def smoothHalo(self):
+        '''
+        :returns: reach in pixels of the filter in smoothDiff
+        '''
+        return int(self.truncate*self.sigma+0.5)
+    
+
+    def highlightDiff(self, diff):
+        '''
+        Highlights spots in the smoothed difference between frames
+
+        :param diff: (h, w) array (int32 smoothed difference matrix)
+        :returns: filtered diff with negative values clipped
+        '''
+        return np.maximum(self.circMaxCFAR(diff, self.nGuard, self.nNoise), 0)
+    
+
+    def blockBounds(self, diff, block):
+        '''
+        Upper bounds of highlightDiff per block from block extrema
+
+        Each highlighted pixel is at most its smoothed value minus the smoothed value 
+        of any pixel in the CFAR ring, e.g. the one nGuard+1 pixels to the right. 
+        The maximum of the own block minus the minimum of the surrounding blocks bounds that.
+
+        :param diff: (h, w) array (int32 smoothed difference matrix)
+        :param block: width/height in pixels of blocks
+        :returns: (ceil(h/block), ceil(w/block)) array of values which no highlighted pixel of the block can exceed
+        '''
+        h, w = diff.shape
+        # extrema of each block, the last blocks may be smaller
+        rows, cols = np.arange(0, h, block), np.arange(0, w, block)
+        blockMax = np.maximum.reduceat(np.maximum.reduceat(diff, cols, axis=1), rows, axis=0)
+        blockMin = np.minimum.reduceat(np.minimum.reduceat(diff, cols, axis=1), rows, axis=0)
+        reach = -(-(self.nGuard+1)//block) # blocks to cover ring pixel
+        ringMin = ndimage.minimum_filter(blockMin, size=2*reach+1, mode='nearest')
+        return blockMax-ringMin
+    
+
+    def changeBound(self, diff, block):
+        '''
+        Upper bound of highlightDiff, see blockBounds
+
+        :param diff: (h, w) array (int32 smoothed difference matrix)
+        :param block: width/height in pixels of blocks
+        :returns: value which no highlighted pixel can exceed
+        '''
+        return max(int(self.blockBounds(diff, block).max()), 0)
+    
+
+    def pyramidBlock(self, holeSize, minBlock=4, maxBlock=16):
+        '''
+        Block size for the pyramid bound
+
+        Blocks of about half the hole size keep the windows tight around holes, 
+        larger blocks make the bound cheaper but merge more noise into the windows.
+
+        :param holeSize: maximum width/height of change mask in pixels
+        :param minBlock/maxBlock: range of the block size
+        :returns: largest power of two at most half the hole size within minBlock...maxBlock
+        '''
+        block = minBlock
+        while block*2 <= min(holeSize//2, maxBlock):
+            block *= 2
+        return block
+    
+
+    def filterCandidates(self, diff, candidates, block, pool=None):
+        '''
+        Highlights only windows of blocks which can reach the threshold
+
+        Pixels outside the candidate blocks stay below the threshold by blockBounds, 
+        so the result only differs from highlighting the whole diff by values below the threshold, 
+        which are set to 0. The hits and the chosen threshold are identical.
+
+        :param diff: (h, w) array (int32 smoothed difference matrix)
+        :param candidates: (ceil(h/block), ceil(w/block)) array (bool blocks to highlight)
+        :param block: width/height in pixels of blocks
+        :param pool: optional concurrent.futures executor to filter windows in parallel
+        :returns: highlighted diff with zeros outside the candidate blocks, 
+            None if the windows would cost more than maxWindowCost of filtering the whole diff
+        '''
+        h, w = diff.shape
+        if np.count_nonzero(candidates) > self.maxWindowCost*candidates.size:
+            return None # windows would cover too much anyway
+        labels, _ = ndimage.label(candidates, structure=np.ones((3, 3)))
+        halo = self.nGuard+self.nNoise
+        windows = [(rows.start*block, min(rows.stop*block, h), cols.start*block, min(cols.stop*block, w))
+            for rows, cols in ndimage.find_objects(labels)]
+        # pixels filtered with halos, each window adds overhead like a small one
+        cost = sum((bottom-top+2*halo)*(right-left+2*halo) + self.windowOverhead for top, bottom, left, right in windows)
+        log.debug(f'Filtering {len(windows)} windows with {np.count_nonzero(candidates)/candidates.size:.1%} of the diff')
+        if cost > self.maxWindowCost*h*w:
+            return None
+        
+        filtered = np.zeros_like(diff)
+        def filterWindow(window):
+            self.filterRegion(self.highlightDiff, diff, filtered, halo, *window)
+        
+        for _ in (pool.map if pool else map)(filterWindow, windows):
+            pass # wait for all windows
+        
+        return filtered
+    
+
+    def filterRegion(self, func, diff, filtered, halo, top, bottom, left, right):
+        '''
+        Filters a region of the diff as if filtering the whole diff
+
+        :param func: filter function for (h, w) array
+        :param diff: (h, w) array (int32 difference matrix)
+        :param filtered: (h, w) array to write the filtered region to
+        :param halo: reach in pixels of the filter
+        :param top/bottom/left/right: region indices in diff
+        '''
+        h, w = diff.shape
+        # extend by halo within diff
+        haloTop, haloLeft = max(top-halo, 0), max(left-halo, 0)
+        part = func(diff[haloTop:min(bottom+halo, h), haloLeft:min(right+halo, w)])
+        filtered[top:bottom, left:right] = part[top-haloTop:bottom-haloTop, left-haloLeft:right-haloLeft]
+    
+
+    def filterTiles(self, func, diff, halo, pool, tileSize):
+        '''
+        Applies a filter function on overlapping tiles in parallel
+
+        Each tile is extended by the filter reach, 
+        so the stitched result is identical to filtering the whole diff
+
+        :param func: filter function for (h, w) array
+        :param diff: (h, w) array (int32 difference matrix)
+        :param halo: reach in pixels of the filter
+        :param pool: concurrent.futures executor, None to filter the whole diff at once
+        :param tileSize: width/height in pixels of tiles
+        :returns: filtered diff
+        '''
+        h, w = diff.shape
+        if not pool or (h <= tileSize and w <= tileSize):
+            return func(diff)
+        
+        filtered = np.empty_like(diff)
+        def filterTile(corner):
+            top, left = corner
+            self.filterRegion(func, diff, filtered, halo, top, min(top+tileSize, h), left, min(left+tileSize, w))
+        
+        corners = [(top, left) for top in range(0, h, tileSize) for left in range(0, w, tileSize)]
+        for _ in pool.map(filterTile, corners):
+            pass # wait for all tiles
+        
+        return filtered
+    
+
     def circMaxCFAR(self, diff, nGuard=5, nNoise=2):
         '''
         Tries to highlight spots
@@ -476,46 +1203,89 @@ class Analysis:
         :param nNoise: width in pixels of ring where to collect noise beyond spot
         :returns: diff-filtered
         '''
-        # build circular footprint mask
-        size = 2*(nGuard+nNoise)+1
-        mask = np.zeros((size, size), dtype=bool)
-        v = np.arange(size)-size//2
-        xx, yy = np.meshgrid(v, v)
-        dist2 = xx**2+yy**2
-        mask[dist2 > nGuard**2] = True
-        mask[dist2 > (nGuard+nNoise)**2] = False
-        # apply footprint
-        filtered = ndimage.maximum_filter(diff, footprint=mask)
-    
+        filtered = annularMax(diff, nGuard, nNoise) # maximum in ring around each pixel
         return diff-filtered
     
 
+    def findThresh(self, step=2):
+        '''
+        Increases self.thresh in steps until all changed areas are valid
+
+        Gives the same threshold as repeating analyzeDiff with increasing thresholds, 
+        but the components are only labeled within the change bounds 
+        and only when the number of changed pixels differs from the last try
+
+        :param step: threshold increase per try
+        :returns: number of increases
+        '''
+        # number of pixels at or above each diff value
+        nAbove = np.cumsum(np.bincount(self.diff.ravel())[::-1])[::-1]
+        # maxima of each row and column give the change bounds for any threshold
+        rowMax = self.diff.max(axis=1)
+        colMax = self.diff.max(axis=0)
+        
+        tries = 0
+        lastChange = None
+        while True:
+            thresh = self.thresh+step*tries
+            nChange = nAbove[max(thresh, 0)] if thresh < len(nAbove) else 0
+            if nChange == 0:
+                break # no change
+            if nChange != lastChange:
+                # label changes within bounds
+                rows = np.flatnonzero(rowMax >= thresh)
+                cols = np.flatnonzero(colMax >= thresh)
+                window = self.diff[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]
+                _, valid = self.scoreChanges(window >= thresh)
+                lastChange = nChange
+                if valid.all():
+                    break
+            tries += 1
+        
+        self.thresh += step*tries
+        return tries
+    
+
+    def scoreChanges(self, mask):
+        '''
+        Labels connected changes and checks their bounds
+
+        :param mask: (h, w) array (bool change mask)
+        :returns: (bounds, valid) where bounds is a (n, 4) array of 
+            left, right, top, bottom indices for each change and 
+            valid tells if the change has the expected size and is near square
+        '''
+        labels, _ = ndimage.label(mask, structure=np.ones((3, 3)))
+        slices = ndimage.find_objects(labels)
+        bounds = np.array([(s[1].start, s[1].stop-1, s[0].start, s[0].stop-1) for s in slices], dtype=int).reshape(-1, 4)
+        width = bounds[:, 1]-bounds[:, 0]
+        height = bounds[:, 3]-bounds[:, 2]
+        ratioErr = np.abs(1.-width/(height+1e-6)) # we expect something near square
+        valid = (self.minSize <= width) & (width <= self.maxSize) & (self.minSize <= height) & (height <= self.maxSize) & (ratioErr < self.maxSquareErr)
+        return bounds, valid
+    
+
     def analyzeDiff(self):
         '''
         Analyzes the self.diff matrix
         '''
         self.valid = False
         self.result = ''
+        self.hits = []
         
         self.mask = self.diff >= self.thresh
         # analyze threshold mask
-        iMask = np.argwhere(self.mask )
-        nChange = len(iMask)
-        log.debug(f'{nChange} pixels changed')
-        if nChange > 0:
-            # getting change bounds
-            x = iMask[:, 1]
-            xMin, xMax = np.min(x), np.max(x)
-            y = iMask[:, 0]
-            yMin, yMax = np.min(y), np.max(y)
-            self.rect = Rect(xMin, xMax, yMin, yMax)
-            log.debug(f'Change width: {self.rect.width}, height: {self.rect.height}')
-            # check valid size
-            ratioErr = abs(1.-self.rect.width/(self.rect.height+1e-6)) # we expect something near square
-            log.debug(f'ratioErr: {ratioErr:.2f}')
-            if self.minSize <= self.rect.width <= self.maxSize and self.minSize <= self.rect.height <= self.maxSize and ratioErr < self.maxSquareErr:
+        self.changed = np.count_nonzero(self.mask)
+        log.debug(f'{self.changed} pixels changed')
+        if self.changed > 0:
+            # check size of each connected change
+            bounds, valid = self.scoreChanges(self.mask)
+            log.debug(f'{len(bounds)} changes, {np.count_nonzero(valid)} valid')
+            if valid.all():
                 self.valid = True
-                self.result = 'valid change'
+                self.hits = [Rect(*bound) for bound in bounds.tolist()]
+                self.rect = self.hits[0]
+                self.result = 'valid change' if len(self.hits) == 1 else f'{len(self.hits)} valid changes'
             else:
                 log.warning('Too many pixels changed')
                 self.result = 'too much change'
@@ -530,12 +1300,38 @@ class Analysis:
         if not self.valid:
             raise ValueError('Last analyzeDiff did not yield a valid change')
 
-        maxThresh = np.max(self.diff[self.mask])
-        minThresh = np.max(self.diff[~self.mask])
+        # histogram of diff values gives both in one pass
+        counts = np.bincount(self.diff.ravel())
+        maxThresh = len(counts)-1
+        minThresh = np.flatnonzero(counts[:self.thresh]).max()
         
         return (minThresh, maxThresh)
     
 
+    def summary(self):
+        '''
+        :returns: dictionary of analysis results without the diff and mask matrices
+        '''
+        return {key: val for key, val in vars(self).items() if key not in ('diff', 'mask')}
+    
+
+    @classmethod
+    def fromSummary(cls, summary, diff, mask):
+        '''
+        Restores an analysis from results computed elsewhere
+
+        :param summary: dictionary from summary method
+        :param diff: (h, w) array (int32 filtered difference matrix)
+        :param mask: (h, w) array (bool change mask)
+        :returns: new Analysis object
+        '''
+        analysis = cls.__new__(cls)
+        analysis.__dict__.update(summary)
+        analysis.diff = diff
+        analysis.mask = mask
+        return analysis
+    
+
     def __repr__(self):
         return f'<Analysis({self.result})>'
     
@@ -0,0 +1,281 @@
+import numpy as np # for the coordinate store
+from threading import RLock # for mutations from several threads
+from collections import defaultdict, deque # for the grid index and the change log
+
+
+class MarkStore:
+    '''
+    Thread-safe marks with stable ids
+
+    Coordinates are kept in creation order in an array,
+    a grid of cells maps coordinates to mark ids for constant time neighbour checks.
+    Every change increments the version and is recorded in a bounded change log,
+    so readers can fetch the marks changed since the version they know.
+    '''
+    def __init__(self, cellSize=8, logSize=1024, onChange=None):
+        '''
+        :param cellSize: width and height of grid cells in pixels,
+            duplicate checks with tolerances up to cellSize look at 3x3 cells at most
+        :param logSize: number of changes kept for changesSince
+        :param onChange: function called without arguments after changes, e.g. to notify clients
+        '''
+        self.lock = RLock()
+        self.cellSize = cellSize
+        self.onChange = onChange
+        self.version = 0 # incremented by each change
+        self.lastId = 0 # ids are never reused, not even after clear
+        self.log = deque(maxlen=logSize) # (version, mark id)
+        self.coords = np.zeros((16, 2), dtype=np.int32) # (x, y) per row
+        self.ids = np.zeros(16, dtype=np.int64) # mark id per row, 0 for removed marks
+        self.nRows = 0 # used rows including removed marks
+        self.rows = {} # mark id: row
+        self.grid = defaultdict(set) # (column, row) cell: mark ids
+    
+
+    def __len__(self):
+        return len(self.rows)
+    
+
+    def __contains__(self, markId):
+        return markId in self.rows
+    
+
+    def cell(self, pos):
+        return (int(pos[0])//self.cellSize, int(pos[1])//self.cellSize)
+    
+
+    def uncell(self, markId, row):
+        '''
+        Removes a mark from its grid cell, call with lock
+        '''
+        cell = self.cell(self.coords[row])
+        self.grid[cell].discard(markId)
+        if not self.grid[cell]:
+            del self.grid[cell]
+    
+
+    def changed(self, markIds):
+        '''
+        Records changes of marks, call with lock
+        '''
+        for markId in markIds:
+            self.version += 1
+            self.log.append((self.version, markId))
+    
+
+    def notify(self):
+        if self.onChange is not None:
+            self.onChange()
+    
+
+    def insert(self, pos):
+        '''
+        Adds a mark without notification, call with lock
+
+        :returns: id of new mark
+        '''
+        if self.nRows == len(self.ids):
+            # grow arrays
+            self.coords = np.concatenate((self.coords, np.zeros_like(self.coords)))
+            self.ids = np.concatenate((self.ids, np.zeros_like(self.ids)))
+        self.lastId += 1
+        row = self.nRows
+        self.nRows += 1
+        self.coords[row] = pos
+        self.ids[row] = self.lastId
+        self.rows[self.lastId] = row
+        self.grid[self.cell(pos)].add(self.lastId)
+        self.changed([self.lastId])
+        return self.lastId
+    
+
+    def add(self, pos):
+        '''
+        Adds a mark
+
+        :param pos: (x, y) center of mark
+        :returns: id of new mark
+        '''
+        with self.lock:
+            markId = self.insert(pos)
+        self.notify()
+        return markId
+    
+
+    def extend(self, positions):
+        '''
+        Adds marks with one notification
+
+        :param positions: iterable of (x, y) centers of marks
+        :returns: list of ids of new marks
+        '''
+        with self.lock:
+            markIds = [self.insert(pos) for pos in positions]
+        if markIds:
+            self.notify()
+        return markIds
+    
+
+    def get(self, markId, default=None):
+        '''
+        :returns: (x, y) center of mark or default if there is no such mark
+        '''
+        with self.lock:
+            row = self.rows.get(markId)
+            if row is None:
+                return default
+            x, y = self.coords[row]
+            return (int(x), int(y))
+    
+
+    def move(self, markId, pos, notify=True):
+        '''
+        Changes the position of a mark
+
+        :param markId: mark id
+        :param pos: new (x, y) center of mark
+        :param notify: False to skip notification when applying several edits
+        '''
+        with self.lock:
+            row = self.rows[markId]
+            self.uncell(markId, row)
+            self.coords[row] = pos
+            self.grid[self.cell(pos)].add(markId)
+            self.changed([markId])
+        if notify:
+            self.notify()
+    
+
+    def remove(self, markId, notify=True):
+        '''
+        Removes a mark
+
+        :param markId: mark id
+        :param notify: False to skip notification when applying several edits
+        '''
+        with self.lock:
+            row = self.rows.pop(markId)
+            self.uncell(markId, row)
+            self.ids[row] = 0
+            self.changed([markId])
+            if self.nRows > 16 and len(self.rows) < self.nRows//2:
+                self.compact()
+        if notify:
+            self.notify()
+    
+
+    def compact(self):
+        '''
+        Drops rows of removed marks keeping the creation order, call with lock
+        '''
+        keep = np.flatnonzero(self.ids[:self.nRows])
+        n = len(keep)
+        self.coords[:n] = self.coords[keep]
+        self.ids[:n] = self.ids[keep]
+        self.ids[n:] = 0
+        self.nRows = n
+        self.rows = {int(markId): row for row, markId in enumerate(self.ids[:n])}
+    
+
+    def clear(self):
+        '''
+        Removes all marks
+        '''
+        with self.lock:
+            markIds = list(self.rows)
+            self.rows.clear()
+            self.grid.clear()
+            self.ids[:] = 0
+            self.nRows = 0
+            self.changed(markIds)
+        if markIds:
+            self.notify()
+    
+
+    def items(self):
+        '''
+        :returns: list of (mark id, (x, y)) in creation order
+        '''
+        with self.lock:
+            rows = np.flatnonzero(self.ids[:self.nRows])
+            return [(int(markId), (int(x), int(y))) for markId, (x, y) in zip(self.ids[rows], self.coords[rows])]
+    
+
+    def positions(self):
+        '''
+        :returns: (n, 2) array (x, y per mark) in creation order
+        '''
+        with self.lock:
+            return self.coords[np.flatnonzero(self.ids[:self.nRows])]
+    
+
+    def isDouble(self, pos, tolerance=3):
+        '''
+        Checks if a mark is already close to pos
+
+        :param pos: (x, y) center of mark
+        :param tolerance: x/y max distance tolerance to other mark to count as double
+        :returns: True if a mark is within tolerance
+        '''
+        x, y = int(pos[0]), int(pos[1])
+        (left, top), (right, bottom) = self.cell((x-tolerance, y-tolerance)), self.cell((x+tolerance, y+tolerance))
+        with self.lock:
+            for column in range(left, right+1):
+                for row in range(top, bottom+1):
+                    for markId in self.grid.get((column, row), ()):
+                        otherX, otherY = self.coords[self.rows[markId]]
+                        if abs(x-otherX) <= tolerance and abs(y-otherY) <= tolerance:
+                            return True
+        return False
+    
+
+    def changesSince(self, version):
+        '''
+        :param version: version known by the caller
+        :returns: current version and dictionary of changed mark id: (x, y) center or None if removed,
+            None instead of the dictionary if the change log does not reach back to version
+        '''
+        with self.lock:
+            if version == self.version:
+                return version, {}
+            if not self.log or self.log[0][0] > version+1:
+                return self.version, None
+            recent = []
+            for changeVersion, markId in reversed(self.log):
+                if changeVersion <= version:
+                    break
+                recent.append(markId)
+            changes = {} # in order of change, new marks in creation order
+            for markId in reversed(recent):
+                if markId not in changes:
+                    changes[markId] = self.get(markId)
+            return self.version, changes
+    
+
+    def apply(self, edits):
+        '''
+        Applies several edits with one notification
+
+        :param edits: list of dictionaries with "action" ("delete", "copy" or "correct"),
+            mark "id" and for correct the new "pos" (x, y)
+        :returns: list of ids of new marks created by copies
+        :raises KeyError: for an unknown mark id, edits before are kept
+        '''
+        newIds = []
+        try:
+            with self.lock:
+                for edit in edits:
+                    action, markId = edit['action'], edit['id']
+                    if markId not in self.rows:
+                        raise KeyError(f'Mark {markId} does not exist')
+                    if action == 'delete':
+                        self.remove(markId, notify=False)
+                    elif action == 'copy':
+                        newIds.append(self.insert(self.get(markId)))
+                    elif action == 'correct':
+                        self.move(markId, edit['pos'], notify=False)
+                    else:
+                        raise ValueError(f'Unknown mark action {action}')
+        finally:
+            self.notify()
+        return newIds
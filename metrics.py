@@ -0,0 +1,89 @@
+import math # for infinite bucket bounds
+
+
+contentType = 'text/plain; version=0.0.4; charset=utf-8' # Prometheus text exposition format
+
+
+def formatValue(value):
+    '''
+    :param value: number
+    :returns: sample value string, e.g. "+Inf" for infinity
+    '''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def formatLabels(labels):
+    '''
+    :param labels: dictionary of label name: value
+    :returns: label string like {stage="crop"}, empty without labels
+    '''
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Exposition:
+    '''
+    Collects metrics in the Prometheus text exposition format
+
+    Each metric family starts with family, followed by its samples.
+    '''
+    def __init__(self):
+        self.lines = []
+    
+
+    def family(self, name, kind, help):
+        '''
+        :param name: metric name
+        :param kind: "counter", "gauge" or "histogram"
+        :param help: description of the metric
+        '''
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {kind}')
+    
+
+    def sample(self, name, value, **labels):
+        '''
+        :param name: metric name with suffix, e.g. "_bucket"
+        :param value: number
+        :param labels: label name: value
+        '''
+        self.lines.append(f'{name}{formatLabels(labels)} {formatValue(value)}')
+    
+
+    def metric(self, name, kind, help, value, **labels):
+        '''
+        Adds a family with a single sample
+        '''
+        self.family(name, kind, help)
+        self.sample(name, value, **labels)
+    
+
+    def histogram(self, name, bounds, counts, total, **labels):
+        '''
+        Adds the samples of one histogram
+
+        :param name: metric name
+        :param bounds: increasing upper bounds of the buckets without +Inf
+        :param counts: cumulative number of observations at or below each bound and in total
+        :param total: sum of the observations
+        :param labels: label name: value
+        '''
+        for bound, count in zip((*bounds, math.inf), counts):
+            self.sample(f'{name}_bucket', count, **labels, le=formatValue(bound))
+        self.sample(f'{name}_sum', total, **labels)
+        self.sample(f'{name}_count', counts[-1], **labels)
+    
+
+    def text(self):
+        '''
+        :returns: bytes of the exposition
+        '''
+        return ('\n'.join(self.lines) + '\n').encode()
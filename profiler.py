@@ -0,0 +1,110 @@
+import sys # for the stacks of all threads
+import os # for short file names
+import marshal # for pstats dumps
+import threading # for thread names
+import time # for the sampling rate
+from collections import Counter # for counting stacks
+
+
+formats = ('collapsed', 'pstats') # output formats of profiles
+lock = threading.Lock() # one profile at a time, overlapping profiles would sample each other
+
+
+def sampleStacks(seconds, rate=100, threadPrefix=''):
+    '''
+    Samples the stacks of all other threads at a fixed rate
+
+    Only runs while called, the sampled threads are not instrumented.
+
+    :param seconds: sampling duration in seconds
+    :param rate: samples per second
+    :param threadPrefix: only sample threads whose name starts with it, empty for all
+    :returns: Counter of (thread name, stack) where stack is a tuple of
+        (file name, first line, function name) from the outermost to the innermost call
+    '''
+    own = threading.get_ident()
+    samples = Counter()
+    interval = 1./rate
+    with lock:
+        nextSample = time.monotonic()
+        end = nextSample+seconds
+        while nextSample < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == own or not name.startswith(threadPrefix):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                samples[(name, tuple(reversed(stack)))] += 1
+            nextSample += interval
+            time.sleep(max(nextSample-time.monotonic(), 0.))
+    return samples
+
+
+def collapsed(samples):
+    '''
+    :param samples: Counter from sampleStacks
+    :returns: bytes of collapsed stacks, one "thread;outer;...;inner count" line per stack,
+        the input format of flamegraph tools
+    '''
+    lines = []
+    for (name, stack), count in samples.most_common():
+        calls = (f'{function} ({os.path.basename(fileName)}:{line})' for fileName, line, function in stack)
+        lines.append(';'.join((name, *calls)) + f' {count}')
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def pstatsDump(samples, rate=100):
+    '''
+    Synthesizes profile statistics from stack samples
+
+    Each sample counts as one call taking a sampling interval,
+    the own time goes to the innermost function and the cumulative time to all functions in the stack.
+
+    :param samples: Counter from sampleStacks
+    :param rate: samples per second of the samples
+    :returns: bytes readable with pstats.Stats after writing them to a file
+    '''
+    interval = 1./rate
+    stats = {} # function: [primitive calls, calls, own time, cumulative time, callers]
+    for (_, stack), count in samples.items():
+        seen = set() # count recursive functions once per sample
+        for depth, function in enumerate(stack):
+            entry = stats.setdefault(function, [0, 0, 0., 0., {}])
+            if function not in seen:
+                seen.add(function)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += count*interval
+            if depth == len(stack)-1:
+                entry[2] += count*interval
+            if depth > 0:
+                caller = entry[4].setdefault(stack[depth-1], [0, 0, 0., 0.])
+                caller[0] += count
+                caller[1] += count
+                caller[2] += count*interval if depth == len(stack)-1 else 0.
+                caller[3] += count*interval
+    return marshal.dumps({function: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+        for function, (cc, nc, tt, ct, callers) in stats.items()})
+
+
+def profile(seconds, rate=100, threadPrefix='', outputFormat='collapsed'):
+    '''
+    Samples the stacks of all other threads and renders the profile
+
+    :param seconds: sampling duration in seconds
+    :param rate: samples per second
+    :param threadPrefix: only sample threads whose name starts with it, empty for all
+    :param outputFormat: one of formats
+    :returns: (content type, bytes) of the profile
+    '''
+    if outputFormat not in formats:
+        raise ValueError(f'Unknown profile format {outputFormat}, use one of {formats}')
+    samples = sampleStacks(seconds, rate, threadPrefix)
+    if outputFormat == 'pstats':
+        return 'application/octet-stream', pstatsDump(samples, rate)
+    return 'text/plain; charset=utf-8', collapsed(samples)
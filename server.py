@@ -4,79 +4,592 @@ if emulation.emulated:
     from emulation import PiCamera
 else:
     from picamera import PiCamera # to access the camera
-from imgproc import FrameAnalysis, State # for camera frame processing
+from imgproc import FrameAnalysis, State, DropPolicy, StreamVariant # for camera frame processing
+from telemetry import Telemetry # for per-frame records
+from tracing import Tracer # for the pipeline trace
 from target import Target # to display rings and value marks
+from backend import ProcessBackend # for analysing in another process
+from encoders import makeEncoder # for the stream JPEG encoder
+from hub import BroadcastHub # for sharing events with all clients
+import websocket # for the combined frame and event channel
+import metrics # for the Prometheus endpoint
+import profiler # for profiling the running server
 import logging # for more advanced prints
 import socketserver # to make a server
 from http import server # to handle http requests
 import json # for parsing POST requests
-import time # for waiting
+from urllib.parse import urlsplit, parse_qs, unquote # for stream variant parameters and file paths
+import asyncio # for serving all clients from one event loop
+from http import HTTPStatus # for response status phrases
+import mimetypes # for content types of static files
+import os # for static file paths
+import socket # for the server name
+import time # for rate limiting events
+from threading import Event, Lock, Thread # for building events once for all clients and WebSocket senders
+from functools import partial # for deferred mark snapshots
+from concurrent.futures import ThreadPoolExecutor # for filtering tiles in parallel
 
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(f'spotter_{__name__}')
 
-updateSettings = {}
+hub = BroadcastHub() # server sent events shared by all clients
 target = Target(name='100 m Gewehr, 25 m Pistole', holeDia=5.5)
 
 
-class StreamingHandler(server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.oldState = None
-        self.oldFrameCnt = None
-        self.oldMirror = None
-        self.oldMarks = None
-        self.oldMarkDia = None
-        self.oldTargetName = None
-        super().__init__(*args, directory='html', **kwargs)
+def pixToPercent(pix):
+    '''
+    Converts pixel size to size in percent 
+    to the current stream image
+
+    :param pix: (x, y) pixel values
+    '''
+    if spotter.state == State.PREVIEW:
+        # workaround
+        height = camera.resolution[0]
+        dims = (height, height)
+    else:
+        dims = spotter.streamDims
     
+    return (100*pix[0]/dims[0], 100*pix[1]/dims[1])
 
-    def pixToPercent(self, pix):
-        '''
-        Converts pixel size to size in percent 
-        to the current stream image
 
-        :param pix: (x, y) pixel values
-        '''
-        if spotter.state == State.PREVIEW:
-            # workaround
-            height = camera.resolution[0]
-            dims = (height, height)
-        else:
-            dims = spotter.streamDims
-        
-        return (100*pix[0]/dims[0], 100*pix[1]/dims[1])
+def pointPercent(point):
+    '''
+    Percent of point pixel coordinates on background stream
+
+    :param point: (left, top) pixel coordinates
+    :returns: dictionary with keys "left", "top"
+        and values in percentage
+    '''
+    percent = pixToPercent(point)
+    return {'left': percent[0], 'top': percent[1]}
+
+
+def rectPercent(rect):
+    '''
+    Percent of rect pixel coordinates on background stream
+
+    :param rect: Rect object in pixel coordinates
+    :returns: dictionary with keys "left", "top", "width", "height"
+        and values in percentage
+    '''
+    posPercent = pixToPercent((rect.left, rect.top))
+    sizePercent = pixToPercent((rect.width, rect.height))
+    percent = {
+        'left': posPercent[0], 
+        'top': posPercent[1], 
+        'width': sizePercent[0], 
+        'height': sizePercent[1]
+    }
+    return percent
+
+
+# topics besides settings depending on a setting
+settingTopics = {
+    'target': ('rings', 'marks'), 
+    'markdia': ('marks',), 
+    'ringswidth': ('rings', 'marks'), 
+    'ringsheight': ('rings', 'marks'), 
+    'ringsleft': ('rings', 'marks'), 
+    'ringstop': ('rings', 'marks')
+}
+
+
+def applySetting(param, value):
+    '''
+    Changes a setting without notifying clients, see applySettings
+
+    :param param: setting name
+    :param value: new value
+    '''
+    log.info(f'Setting {param} to {value}')
+    if param == 'contrast':
+        # set camera contrast
+        camera.contrast = int(value)
+    elif param == 'brightness':
+        # set camera brightness
+        camera.brightness = int(value)
+    elif param == 'threshold':
+        # set difference detection threshold
+        spotter.thresh = int(value)
+    elif param == 'average':
+        # set number of frames per slot to average
+        spotter.nSlotFrames = int(value)
+    elif param == 'mode':
+        # change mode
+        modes = {
+            'start': State.START, 
+            'preview': State.PREVIEW
+        }
+        spotter.state = modes.get(value, State.PREVIEW)
+    elif param == 'showdiff':
+        # show normal or diff image
+        spotter.showDiff = value
+    elif param == 'target':
+        # set target type
+        target.fromDatabase(value)
+    elif param == 'markdia':
+        # set mark size
+        target.holeDia = float(value)
+    elif param == 'ringswidth':
+        # scale mirror in x
+        spotter.mirrorScale = ((float(value)+100)/100, spotter.mirrorScale[1])
+    elif param == 'ringsheight':
+        # scale mirror in y
+        spotter.mirrorScale = (spotter.mirrorScale[0], (float(value)+100)/100)
+    elif param == 'ringsleft':
+        # move mirror in x
+        spotter.mirrorTranslate = (int(value), spotter.mirrorTranslate[1])
+    elif param == 'ringstop':
+        # move mirror in y
+        spotter.mirrorTranslate = (spotter.mirrorTranslate[0], int(value))
+    elif param == 'saverings':
+        # check if mirror rings and related settings should reset at start
+        spotter.keepMirror = value
+
+
+def applySettings(settings):
+    '''
+    Changes settings requested by clients and notifies clients about the changed ones, 
+    called by the analysis worker with the latest value of each requested setting
+
+    :param settings: dictionary of setting name: new value
+    '''
+    before = currentSettings()
+    for param, value in settings.items():
+        try:
+            applySetting(param, value)
+        except (ValueError, TypeError, KeyError):
+            log.exception(f'Invalid value {value!r} for setting {param}')
+    changed = [param for param, value in currentSettings().items() if before[param] != value]
     
+    # update settings and what depends on them for all clients
+    topics = {'settings'} if changed else set()
+    for param in changed:
+        topics.update(settingTopics.get(param, ()))
+    if topics:
+        spotter.versions.bump(*topics)
+
+
+def applyMark(data):
+    '''
+    Changes marks requested by a client
+
+    :param data: dictionary with "action" ("delete", "copy" or "correct"), 
+        "id" of the mark (or its "index" in creation order) and for correct the new "pos" with "left" and "top", 
+        or dictionary with a list of such edits in "edits", applied at once
+    '''
+    edits = []
+    for edit in data['edits'] if 'edits' in data else [data]:
+        markId = edit['id'] if 'id' in edit else spotter.marks.items()[edit['index']][0]
+        log.info(f'Client wants to {edit["action"]} mark {markId}')
+        change = {'action': edit['action'], 'id': markId}
+        if 'pos' in edit:
+            change['pos'] = (int(edit['pos']['left']), int(edit['pos']['top']))
+        edits.append(change)
+    try:
+        spotter.marks.apply(edits)
+    except (KeyError, ValueError) as e:
+        log.warning(f'Failed to change marks: {e}')
+
+
+def handlePost(path, body):
+    '''
+    Applies a POST request of a client
+
+    :param path: request path
+    :param body: request body bytes with JSON data
+    '''
+    handleCommand(path, json.loads(body.decode()))
+
+
+def handleCommand(path, data):
+    '''
+    Applies a command of a client sent by POST or WebSocket
+
+    :param path: command path like "/settings", "/setting" or "/mark"
+    :param data: dictionary of command data
+    '''
+    log.debug(f'Got {path} data: {data}')
+    if path == '/settings':
+        # client wants to change several parameters, applied with the next frame
+        spotter.requestSettings(data)
+    elif path == '/setting':
+        # client wants to change a parameter
+        spotter.requestSettings({data['param']: data['value']})
+    elif path == '/mark':
+        # client wants to change a mark
+        applyMark(data)
+
+
+def websocketCommand(payload):
+    '''
+    Applies a command received over a WebSocket
+
+    :param payload: JSON bytes with "path" like "/setting" and command "data"
+    '''
+    try:
+        command = json.loads(payload.decode())
+        handleCommand(command['path'], command['data'])
+    except Exception:
+        log.exception('Failed to apply WebSocket command')
+
+
+def currentSettings():
+    '''
+    :returns: dictionary of setting name: current value
+    '''
+    return {
+        'contrast': camera.contrast, 
+        'brightness': camera.brightness, 
+        'threshold': spotter.thresh, 
+        'average': spotter.nSlotFrames, 
+        'showdiff': spotter.showDiff, 
+        'target': target.name, 
+        'markdia': target.holeDia, 
+        'ringswidth': spotter.mirrorScale[0]*100-100, 
+        'ringsheight': spotter.mirrorScale[1]*100-100, 
+        'ringsleft': spotter.mirrorTranslate[0], 
+        'ringstop': spotter.mirrorTranslate[1], 
+        'saverings': spotter.keepMirror, 
+        'mode': 'Start' if spotter.state == State.PREVIEW else 'Stop'
+    }
+
+
+def updateEvent():
+    data = {}
+    # get debug infos
+    infos = {
+        'Processing time': f'{(spotter.procTime*1e3):.2f} ms', 
+        'Analysis throughput': f'{spotter.analysisRate:.1f} 1/s', 
+        'Dropped frames': f'{spotter.droppedFrames}/{spotter.capturedFrames}', 
+        'Exposure time': f'{(camera.exposure_speed/1e3):.2f} ms', 
+        'Last analysis': '--' if spotter.analysis is None else str(spotter.analysis), 
+        'Stream encodes': f'{spotter.encodeCnt} ({spotter.skippedEncodes} skipped)', 
+        'Skipped analyses': f'{spotter.skippedAnalyses}/{spotter.skippedAnalyses+spotter.fullAnalyses}', 
+        'Threshold retries': '--' if spotter.analysis is None else f'{spotter.analysis.tries} ({spotter.threshRetries} total)'
+    }
+    # percentiles of stage durations
+    for name, stats in spotter.timings.stats().items():
+        infos[f'Stage {name} p50/p95/p99'] = f'{stats["p50"]*1e3:.2f}/{stats["p95"]*1e3:.2f}/{stats["p99"]*1e3:.2f} ms'
+    data.update({'infos': infos})
+    
+    # get progress of averaging or filling slots
+    progress = spotter.progress
+    if progress is not None:
+        data.update({'progress': 100*progress})
+    
+    return {'update': data}
+
+
+def stateEvent():
+    data = {'state': str(spotter.state).split('.')[1]}
+    
+    # put in mirror picker size
+    if spotter.state == State.PREVIEW:
+        w, h = pixToPercent((spotter.mirrorPickSize, spotter.mirrorPickSize))
+        picker = {'width': w, 'height': h}
+        data.update({'pickersize': picker})
+    
+    return {'state': data}
+
+
+def ringsEvent():
+    if spotter.state == State.DETECT:
+        newMirror = spotter.corrMirrorBounds
+    elif spotter.state == State.COLLECT:
+        newMirror = spotter.pickBounds
+    else:
+        newMirror = None
+    
+    # corrected mirror coordinates in percent to stream
+    if newMirror:
+        target.mirrorBounds = newMirror # update mirror bounds
+        rings = [rectPercent(ring) for ring in target.ringBounds]
+    else:
+        rings = []
+    return {'rings': rings}
+
+
+def markEntry(markId, pos):
+    '''
+    :param markId: mark id
+    :param pos: (x, y) center of mark
+    :returns: dictionary of mark for the client
+    '''
+    return {
+        'id': markId, 
+        'pixpos': {'left': pos[0], 'top': pos[1]}, 
+        'relpos': pointPercent(pos), 
+        'ring': target.pointInRing(pos) # look up ring
+    }
 
-    def pointPercent(self, point):
-        '''
-        Percent of point pixel coordinates on background stream
 
-        :param point: (left, top) pixel coordinates
-        :returns: dictionary with keys "left", "top"
-            and values in percentage
+def markSize():
+    '''
+    :returns: dictionary with mark "width" and "height" in percent
+    '''
+    p = target.holeSize
+    markSize = pixToPercent((p, p))
+    return {'width': markSize[0], 'height': markSize[1]}
+
+
+def marksSnapshot(entries, size):
+    '''
+    :param entries: list of mark dictionaries
+    :param size: dictionary of mark size, None if marks are hidden
+    :returns: event data with all marks
+    '''
+    data = {'marks': entries}
+    if size is not None:
+        data.update({'marksize': size})
+    return data
+
+
+def encodeMarksSnapshot(entries, size):
+    '''
+    :returns: bytes of server sent event with all marks, see marksSnapshot
+    '''
+    return encodeEvent(marksSnapshot(entries, size))
+
+
+class SettingsDeltas:
+    '''
+    Builds settings events with only the settings changed since the last event
+    '''
+    def __init__(self):
+        self.settings = {} # sent settings
+    
+
+    def event(self):
+        '''
+        :returns: event data (None if no setting changed) and function returning the encoded event of all settings 
+            (None if the event data already contains all settings)
         '''
-        percent = self.pixToPercent(point)
-        return {'left': percent[0], 'top': percent[1]}
+        settings = currentSettings()
+        changed = {param: value for param, value in settings.items() 
+            if param not in self.settings or self.settings[param] != value}
+        self.settings = settings
+        if not changed:
+            return None, None
+        if len(changed) == len(settings):
+            return {'settings': settings}, None
+        return {'settings': changed}, partial(encodeEvent, {'settings': settings})
+
+
+class MarkDeltas:
+    '''
+    Builds mark events as additions, updates and deletions since the last event
+
+    Only marks changed since the last MarkStore version are looked up and sent. 
+    When the geometry changes (state, mirror, target or mark size), all marks are sent.
+    '''
+    def __init__(self):
+        self.geometry = None
+        self.version = 0 # MarkStore version of sent marks
+        self.entries = {} # mark id: ((x, y), mark dictionary) of sent marks
+        self.markSize = None # dictionary of mark size, None if marks are hidden
     
 
-    def rectPercent(self, rect):
+    def event(self):
         '''
-        Percent of rect pixel coordinates on background stream
+        :returns: event data (None if no mark changed) and function returning the encoded event of all marks 
+            (None if the event data already contains all marks)
+        '''
+        mirror = spotter.corrMirrorBounds
+        visible = bool(mirror) and spotter.state == State.DETECT
+        geometry = (spotter.state, mirror, tuple(spotter.streamDims), target.name, target.holeDia)
+        
+        if geometry != self.geometry:
+            # every mark changes
+            with spotter.marks.lock:
+                self.version = spotter.marks.version
+                marks = spotter.marks.items() if visible else []
+            self.geometry = geometry
+            self.entries = {markId: (pos, markEntry(markId, pos)) for markId, pos in marks}
+            self.markSize = markSize() if visible else None
+            return marksSnapshot([entry for _, entry in self.entries.values()], self.markSize), None
+        
+        self.version, changes = spotter.marks.changesSince(self.version)
+        if not visible:
+            return None, None
+        if changes is None:
+            # change log does not reach back, compare all
+            with spotter.marks.lock:
+                self.version = spotter.marks.version
+                changes = dict(spotter.marks.items())
+            changes.update({markId: None for markId in self.entries if markId not in changes})
+        
+        added, updated, deleted = [], [], []
+        for markId, pos in changes.items():
+            old = self.entries.get(markId)
+            if pos is None:
+                if old is not None:
+                    deleted.append(markId)
+                    del self.entries[markId]
+            elif old is None or old[0] != pos:
+                entry = markEntry(markId, pos)
+                (added if old is None else updated).append(entry)
+                self.entries[markId] = (pos, entry)
+        
+        if not (added or updated or deleted):
+            return None, None
+        delta = {'markdelta': {'add': added, 'update': updated, 'delete': deleted}}
+        return delta, partial(encodeMarksSnapshot, [entry for _, entry in self.entries.values()], self.markSize)
+
+
+def encodeEvent(data):
+    '''
+    :param data: dictionary of event data
+    :returns: JSON bytes of event
+    '''
+    return json.dumps(data).encode()
+
+
+def metricsText():
+    '''
+    Renders counters and gauges for monitoring, 
+    only reads counters, so scraping does not disturb the analysis
+
+    :returns: bytes in the Prometheus text exposition format
+    '''
+    exposition = metrics.Exposition()
+    add = exposition.metric
+    add('spotter_frames_captured_total', 'counter', 'Frames delivered by the camera', spotter.capturedFrames)
+    add('spotter_frames_dropped_total', 'counter', 'Frames dropped because the analysis fell behind', spotter.droppedFrames)
+    add('spotter_frames_processed_total', 'counter', 'Frames processed by the analysis worker', spotter.frameCnt)
+    add('spotter_analyses_total', 'counter', 'Slot comparisons which ran the full analysis', spotter.fullAnalyses)
+    add('spotter_analyses_skipped_total', 'counter', 'Slot comparisons skipped because no change could reach the threshold', spotter.skippedAnalyses)
+    add('spotter_threshold_retries_total', 'counter', 'Threshold increases by analyses', spotter.threshRetries)
+    add('spotter_processing_seconds', 'gauge', 'Processing time of the last frame', spotter.procTime)
+    add('spotter_stream_encodes_total', 'counter', 'Encoded stream images', spotter.encodeCnt)
+    add('spotter_stream_encodes_skipped_total', 'counter', 'Stream frames nobody requested', spotter.skippedEncodes)
+    add('spotter_stream_bytes_total', 'counter', 'Size of encoded stream images', spotter.encodedBytes)
+    add('spotter_stream_encode_seconds_total', 'counter', 'Time converting and encoding stream images', spotter.encodeSeconds)
+    add('spotter_stream_clients', 'gauge', 'Connected clients receiving the stream', spotter.frames.subscribers)
+    add('spotter_event_clients', 'gauge', 'Connected clients receiving events by server sent events or WebSocket', hub.subscribers)
+    add('spotter_marks', 'gauge', 'Marks on the target', len(spotter.marks))
+    add('spotter_threshold', 'gauge', 'Current detection threshold', spotter.thresh)
+    exposition.family('spotter_state', 'gauge', 'Current state, 1 for the active one')
+    for state in State:
+        exposition.sample('spotter_state', int(spotter.state == state), state=state.name)
+    
+    histograms = spotter.timings.histograms()
+    if histograms:
+        exposition.family('spotter_stage_seconds', 'histogram', 'Duration of pipeline stages')
+        for name, (counts, total) in histograms.items():
+            exposition.histogram('spotter_stage_seconds', spotter.timings.buckets, counts, total, stage=name)
+    return exposition.text()
+
 
-        :param rect: Rect object in pixel coordinates
-        :returns: dictionary with keys "left", "top", "width", "height"
-            and values in percentage
+def telemetryFile(path):
+    '''
+    :param path: request path of a telemetry download
+    :returns: (content type, bytes) of the telemetry records or None if there is no such file
+    '''
+    if spotter.telemetry is None:
+        return None
+    if path == '/telemetry.npy':
+        return 'application/octet-stream', spotter.telemetry.npy()
+    if path == '/telemetry.csv':
+        return 'text/csv', spotter.telemetry.csv()
+    return None
+
+
+def profileRequest(query):
+    '''
+    Profiles all threads for the duration given by the query, blocks meanwhile
+
+    :param query: query string with "seconds" (default 5, up to 60), sampling "rate" per second (default 100), 
+        thread name prefix "thread" and output "format" (collapsed or pstats)
+    :returns: (content type, bytes) of the profile
+    :raises ValueError: for invalid parameters
+    '''
+    params = parse_qs(query)
+    seconds = float(params.get('seconds', ['5'])[0])
+    rate = float(params.get('rate', ['100'])[0])
+    if not 0 < seconds <= 60 or not 0 < rate <= 1000:
+        raise ValueError('Profile duration must be within 0...60 s and rate within 0...1000 1/s')
+    log.info(f'Profiling for {seconds} s')
+    return profiler.profile(seconds, rate, params.get('thread', [''])[0], params.get('format', ['collapsed'])[0])
+
+
+def sseMessage(message):
+    '''
+    :param message: JSON bytes of event
+    :returns: bytes of server sent event
+    '''
+    return b'data: ' + message + b'\n\n'
+
+
+class EventBroadcaster(Thread):
+    '''
+    Builds the event of each changed topic once and publishes it to all clients
+
+    Wakes up on version changes of spotter instead of polling, 
+    the frequent update topic is rate limited.
+    '''
+    def __init__(self, minUpdateInterval=0.25):
+        '''
+        :param minUpdateInterval: minimum time in seconds between update events
         '''
-        posPercent = self.pixToPercent((rect.left, rect.top))
-        sizePercent = self.pixToPercent((rect.width, rect.height))
-        percent = {
-            'left': posPercent[0], 
-            'top': posPercent[1], 
-            'width': sizePercent[0], 
-            'height': sizePercent[1]
+        super().__init__(name='events', daemon=True)
+        self.minUpdateInterval = minUpdateInterval
+        self.settings = SettingsDeltas()
+        self.marks = MarkDeltas()
+        # rings before marks, marks need the ring geometry
+        self.builders = {
+            'settings': self.settings.event, 
+            'state': stateEvent, 
+            'rings': ringsEvent, 
+            'marks': self.marks.event, 
+            'update': updateEvent
         }
-        return percent
+        self.incremental = {'settings', 'marks'} # builders returning changes and a snapshot function
+    
+
+    def run(self):
+        known = None # versions of published events, None to publish all
+        current = {}
+        nextUpdate = 0.
+        while True:
+            if known is None:
+                known, current = {}, dict(spotter.versions.counts)
+            else:
+                waitKnown, timeout = known, None
+                if current.get('update', 0) != known.get('update', 0):
+                    # postponed update waits for its time unless other topics change
+                    waitKnown = dict(known, update=current['update'])
+                    timeout = max(nextUpdate-time.monotonic(), 0.)
+                current = spotter.versions.wait(waitKnown, timeout)
+            
+            for topic, build in self.builders.items():
+                version = current.get(topic, 0)
+                if topic in known and known[topic] == version:
+                    continue
+                if topic == 'update':
+                    now = time.monotonic()
+                    if now < nextUpdate:
+                        continue
+                    nextUpdate = now + self.minUpdateInterval
+                try:
+                    if topic in self.incremental:
+                        data, snapshot = build()
+                        if data is None:
+                            known[topic] = version
+                            continue
+                    else:
+                        data, snapshot = build(), None
+                    hub.publish(topic, encodeEvent(data), snapshot)
+                except Exception:
+                    log.exception(f'Failed to build {topic} event')
+                known[topic] = version
+
+
+class StreamingHandler(server.SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory='html', **kwargs)
     
 
     def sendEventStreamHeader(self):
@@ -101,156 +614,148 @@ class StreamingHandler(server.SimpleHTTPRequestHandler):
             self.send_header('Pragma', 'no-cache')
             self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
             self.end_headers()
+            variant = StreamVariant.fromQuery(parse_qs(urlsplit(self.path).query))
             try:
-                while True:
-                    # update stream image
-                    with spotter.condition:
-                        spotter.condition.wait()
-                        frame = spotter.streamImage
-                    self.wfile.write(b'--FRAME\n')
-                    self.send_header('Content-Type', 'image/jpeg')
-                    self.send_header('Content-Length', len(frame))
-                    self.end_headers()
-                    self.wfile.write(frame)
-                    self.wfile.write(b'\n\n')
+                with spotter.frames.subscribe() as cursor:
+                    while True:
+                        # wait for newer stream frame
+                        cursor.seq, frame = spotter.streamImageVariant(variant, cursor.next())
+                        spotter.tracer.annotate(stream=cursor.seq)
+                        with spotter.tracer.span('write'):
+                            self.wfile.write(b'--FRAME\n')
+                            self.send_header('Content-Type', 'image/jpeg')
+                            self.send_header('Content-Length', len(frame))
+                            self.end_headers()
+                            self.wfile.write(frame)
+                            self.wfile.write(b'\n\n')
             except BrokenPipeError:
                 log.info(f'Removed streaming client {self.client_address}')
+        elif urlsplit(self.path).path == '/ws' and websocket.isUpgrade(self.headers):
+            self.websocket()
         elif '/change' in self.path:
             self.sendEventStreamHeader()
             try:
-                while True:
-                    data = {}
-                    self.settingsEvent(data)
-                    self.updateEvent(data)
-                    self.stateEvent(data)
-                    self.ringsEvent(data)
-                    self.marksEvent(data)
-                    if data:
-                        # send data to client
-                        self.wfile.write(f'data: {json.dumps(data)}\n\n'.encode())
-                    
-                    time.sleep(0.25) # reduce idle load
+                with hub.subscribe() as cursor:
+                    while True:
+                        for message in cursor.read():
+                            # send data to client
+                            self.wfile.write(sseMessage(message))
+                        if not cursor.wait(timeout=15):
+                            self.wfile.write(b': keep-alive\n\n') # detect closed connections
             except BrokenPipeError:
                 log.info(f'Removed streaming client {self.client_address}')
+        elif urlsplit(self.path).path.startswith('/telemetry.'):
+            download = telemetryFile(urlsplit(self.path).path)
+            if download is None:
+                self.send_error(404)
+                return
+            contentType, body = download
+            self.send_response(200)
+            self.send_header('Content-Type', contentType)
+            self.send_header('Content-Disposition', f'attachment; filename="{urlsplit(self.path).path[1:]}"')
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
+        elif urlsplit(self.path).path == '/debug/profile':
+            try:
+                contentType, body = profileRequest(urlsplit(self.path).query)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', contentType)
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
+        elif urlsplit(self.path).path == '/debug/trace.json':
+            if not spotter.tracer.enabled:
+                self.send_error(404, 'Tracing is disabled')
+                return
+            body = spotter.tracer.chromeTrace()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
+        elif urlsplit(self.path).path == '/metrics':
+            body = metricsText()
+            self.send_response(200)
+            self.send_header('Content-Type', metrics.contentType)
+            self.send_header('Content-Length', len(body))
+            self.end_headers()
+            self.wfile.write(body)
         else:
             super().do_GET()
     
 
-    def settingsEvent(self, eventData):
-        ip = self.client_address[0]
-        # init update state for each client
-        if ip not in updateSettings:
-            updateSettings[ip] = True
-        # pack settings
-        if updateSettings[ip]:
-            data = {
-                'contrast': camera.contrast, 
-                'brightness': camera.brightness, 
-                'threshold': spotter.thresh, 
-                'average': spotter.nSlotFrames, 
-                'showdiff': spotter.showDiff, 
-                'target': target.name, 
-                'markdia': target.holeDia, 
-                'ringswidth': spotter.mirrorScale[0]*100-100, 
-                'ringsheight': spotter.mirrorScale[1]*100-100, 
-                'ringsleft': spotter.mirrorTranslate[0], 
-                'ringstop': spotter.mirrorTranslate[1], 
-                'saverings': spotter.keepMirror, 
-                'mode': 'Start' if spotter.state == State.PREVIEW else 'Stop'
-            }
-            eventData.update({'settings': data})
-            updateSettings[ip] = False
-    
-
-    def updateEvent(self, eventData):
-        if self.oldFrameCnt != spotter.frameCnt:
-            data = {}
-            # get debug infos
-            infos = {
-                'Processing time': f'{(spotter.procTime*1e3):.2f} ms', 
-                'Exposure time': f'{(camera.exposure_speed/1e3):.2f} ms', 
-                'Last analysis': '--' if spotter.analysis is None else str(spotter.analysis)
-            }
-            data.update({'infos': infos})
-            
-            # get progress
-            if spotter.state == State.DETECT:
-                # average progress
-                progress = spotter.slot.length/spotter.nSlotFrames
-                data.update({'progress': 100*progress})
-            elif spotter.state == State.COLLECT:
-                # filling slots progress
-                curCollect = spotter.slot.length+sum(slot.length for slot in spotter.slots)
-                maxCollect = spotter.maxSlots*spotter.nSlotFrames
-                progress = curCollect/maxCollect
-                data.update({'progress': 100*progress})
-            
-            eventData.update({'update': data})
-            self.oldFrameCnt = spotter.frameCnt
-    
+    def websocket(self):
+        '''
+        Sends stream frames and events over a WebSocket and applies commands of the client
 
-    def stateEvent(self, eventData):
-        if self.oldState != spotter.state:
-            data = {'state': str(spotter.state).split('.')[1]}
-            
-            # put in mirror picker size
-            if spotter.state == State.PREVIEW:
-                w, h = self.pixToPercent((spotter.mirrorPickSize, spotter.mirrorPickSize))
-                picker = {'width': w, 'height': h}
-                data.update({'pickersize': picker})
-            
-            eventData.update({'state': data})
-            self.oldState = spotter.state
-    
+        Frames and events are sent by two threads, a frame is only sent when the previous one is out.
+        '''
+        self.wfile.write(websocket.handshakeResponse(self.headers['Sec-WebSocket-Key']))
+        self.close_connection = True
+        variant = StreamVariant.fromQuery(parse_qs(urlsplit(self.path).query))
+        sendLock = Lock()
+        closed = Event()
 
-    def ringsEvent(self, eventData):
-        if spotter.state == State.DETECT:
-            newMirror = spotter.corrMirrorBounds
-        elif spotter.state == State.COLLECT:
-            newMirror = spotter.pickBounds
-        else:
-            newMirror = None
+        def send(*parts):
+            with sendLock:
+                self.wfile.write(b''.join(parts))
         
-        if self.oldMirror != newMirror:
-            # corrected mirror coordinates in percent to stream
-            if newMirror:
-                target.mirrorBounds = newMirror # update mirror bounds
-                rings = [self.rectPercent(ring) for ring in target.ringBounds]
-            else:
-                rings = []
-            eventData.update({'rings': rings})
-            
-            self.oldMirror = newMirror
-    
-
-    def marksEvent(self, eventData):
-        # changed mark list
-        marksHash = hash(tuple(spotter.marks) if spotter.state == State.DETECT else None)
-        if self.oldMarks != marksHash:
-            data = []
-            # in collect state, get marks
-            mirror = spotter.corrMirrorBounds
-            if mirror and spotter.state == State.DETECT:
-                for pos in spotter.marks:
-                    # look up ring for each mark
-                    ring = target.pointInRing(pos)
-                    mark = {
-                        'pixpos': {'left': pos[0], 'top': pos[1]}, 
-                        'relpos': self.pointPercent(pos), 
-                        'ring': ring
-                    }
-                    data.append(mark)
-                
-                # get mark size
-                p = target.holeSize
-                markSize = self.pixToPercent((p, p))
-                eventData.update({'marksize': {
-                    'width': markSize[0], 
-                    'height': markSize[1]
-                }})
-            
-            eventData.update({'marks': data})
-            self.oldMarks = marksHash
+        def sendFrames():
+            try:
+                with spotter.frames.subscribe() as cursor:
+                    while not closed.is_set():
+                        frame = cursor.next(timeout=1)
+                        if frame is None:
+                            continue # check for closed connection
+                        cursor.seq, image = spotter.streamImageVariant(variant, frame)
+                        spotter.tracer.annotate(stream=cursor.seq)
+                        with spotter.tracer.span('write'):
+                            send(websocket.frameHeader(len(image)), image)
+            except OSError:
+                pass
+            finally:
+                closed.set()
+        
+        def sendEvents():
+            try:
+                with hub.subscribe() as cursor:
+                    while not closed.is_set():
+                        for message in cursor.read():
+                            send(websocket.frameHeader(len(message), websocket.Opcode.TEXT), message)
+                        cursor.wait(timeout=1)
+            except OSError:
+                pass
+            finally:
+                closed.set()
+        
+        senders = [Thread(target=sendFrames, daemon=True), Thread(target=sendEvents, daemon=True)]
+        for sender in senders:
+            sender.start()
+        try:
+            assembler = websocket.MessageAssembler()
+            while not closed.is_set():
+                message = assembler.feed(*websocket.readFrame(self.rfile.read))
+                if message is None:
+                    continue
+                opcode, payload = message
+                if opcode == websocket.Opcode.CLOSE:
+                    send(websocket.closeFrame())
+                    break
+                elif opcode == websocket.Opcode.PING:
+                    send(websocket.frame(payload, websocket.Opcode.PONG))
+                elif opcode == websocket.Opcode.TEXT:
+                    websocketCommand(payload)
+        except (OSError, ValueError) as e:
+            log.debug(f'WebSocket of {self.client_address} failed: {e}')
+        finally:
+            closed.set()
+            for sender in senders:
+                sender.join()
+            log.info(f'Removed WebSocket client {self.client_address}')
     
 
     def do_POST(self):
@@ -258,78 +763,7 @@ class StreamingHandler(server.SimpleHTTPRequestHandler):
         Got POST request
         '''
         self.data_string = self.rfile.read(int(self.headers['Content-Length']))
-        data = json.loads(self.data_string.decode())
-        log.debug(f'Got POST data: {data}')
-
-        # parse data
-        if self.path == '/setting':
-            # client wants to change a parameter
-            param = data['param']
-            value = data['value']
-            log.info(f'Client wants to set {param} to {value}')
-            if param == 'contrast':
-                # set camera contrast
-                camera.contrast = int(value)
-            elif param == 'brightness':
-                # set camera brightness
-                camera.brightness = int(value)
-            elif param == 'threshold':
-                # set difference detection threshold
-                spotter.thresh = int(value)
-            elif param == 'average':
-                # set number of frames per slot to average
-                spotter.nSlotFrames = int(value)
-            elif param == 'mode':
-                # change mode
-                modes = {
-                    'start': State.START, 
-                    'preview': State.PREVIEW
-                }
-                spotter.state = modes.get(value, State.PREVIEW)
-            elif param == 'showdiff':
-                # show normal or diff image
-                spotter.showDiff = value
-            elif param == 'target':
-                # set target type
-                target.fromDatabase(value)
-            elif param == 'markdia':
-                # set mark size
-                target.holeDia = float(value)
-            elif param == 'ringswidth':
-                # scale mirror in x
-                spotter.mirrorScale = ((float(value)+100)/100, spotter.mirrorScale[1])
-            elif param == 'ringsheight':
-                # scale mirror in y
-                spotter.mirrorScale = (spotter.mirrorScale[0], (float(value)+100)/100)
-            elif param == 'ringsleft':
-                # move mirror in x
-                spotter.mirrorTranslate = (int(value), spotter.mirrorTranslate[1])
-            elif param == 'ringstop':
-                # move mirror in y
-                spotter.mirrorTranslate = (spotter.mirrorTranslate[0], int(value))
-            elif param == 'saverings':
-                # check if mirror rings and related settings should reset at start
-                spotter.keepMirror = value
-            
-            # update settings for all clients
-            for k in updateSettings:
-                updateSettings[k] = True
-        elif self.path == '/mark':
-            # client wants to change a mark
-            action = data['action']
-            iMark = data['index']
-            log.info(f'Client wants to {action} mark {iMark}')
-            if action == 'delete':
-                # delete mark
-                del spotter.marks[iMark]
-            elif action == 'copy':
-                # copy mark
-                spotter.marks.append(spotter.marks[iMark])
-            elif action == 'correct':
-                # change position of mark
-                pos = data['pos']
-                pos = (int(pos['left']), int(pos['top']))
-                spotter.marks[iMark] = pos
+        handlePost(self.path, self.data_string)
 
         # respond
         self.send_response(200)
@@ -342,20 +776,346 @@ class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
     daemon_threads = True
 
 
+
+class AsyncStreamingServer:
+    '''
+    Serves the user interface from a single asyncio event loop
+
+    Streams, server sent events and requests share one thread instead of one thread per client. 
+    The analysis thread only schedules a wake-up on the loop for new stream frames, 
+    JPEG encoding runs in a small thread pool.
+    '''
+    def __init__(self, address, directory='html', encodeWorkers=2):
+        '''
+        :param address: (host, port) to listen on
+        :param directory: directory of static files
+        :param encodeWorkers: number of threads encoding stream images
+        '''
+        self.address = address
+        self.directory = os.path.abspath(directory)
+        self.encodePool = ThreadPoolExecutor(encodeWorkers, thread_name_prefix='encode')
+        self.loop = None
+        self.newFrame = None # asyncio.Event replaced on every stream frame
+        self.newEvent = None # asyncio.Event replaced on every published server sent event
+    
+
+    def run(self):
+        '''
+        Serves until interrupted
+        '''
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.encodePool.shutdown(wait=False)
+    
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.newFrame = asyncio.Event()
+        self.newEvent = asyncio.Event()
+        spotter.frames.listeners.append(self.frameReady)
+        hub.listeners.append(self.eventReady)
+        try:
+            server = await asyncio.start_server(self.handle, *self.address)
+            host, port = server.sockets[0].getsockname()[:2]
+            log.info(f'Started user interface on http://{socket.getfqdn(host)}:{port} (asyncio)')
+            log.info('Press ctrl-C to stop')
+            async with server:
+                await server.serve_forever()
+        finally:
+            spotter.frames.listeners.remove(self.frameReady)
+            hub.listeners.remove(self.eventReady)
+    
+
+    def frameReady(self):
+        '''
+        Called in the analysis thread for a new stream frame, wakes up the stream clients
+        '''
+        self.loop.call_soon_threadsafe(self.wake, 'newFrame')
+    
+
+    def eventReady(self):
+        '''
+        Called in the publishing thread for a new server sent event, wakes up the event clients
+        '''
+        self.loop.call_soon_threadsafe(self.wake, 'newEvent')
+    
+
+    def wake(self, name):
+        '''
+        Wakes up all waiters of an event and replaces it for the next waiters
+
+        :param name: attribute name of the asyncio.Event
+        '''
+        event = getattr(self, name)
+        setattr(self, name, asyncio.Event())
+        event.set()
+    
+
+    async def readRequest(self, reader):
+        '''
+        :returns: method, path, headers dictionary with lower case keys and body bytes, 
+            None if the connection was closed
+        '''
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, path, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method, path, headers, body
+    
+
+    def response(self, writer, status, headers=(), body=b''):
+        '''
+        Writes a response with content length
+
+        :param status: HTTP status code
+        :param headers: list of (name, value) header tuples
+        :param body: response bytes
+        '''
+        head = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}', f'Content-Length: {len(body)}']
+        head += [f'{key}: {value}' for key, value in headers]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+    
+
+    async def handle(self, reader, writer):
+        '''
+        Handles requests of one connection
+        '''
+        client = writer.get_extra_info('peername')
+        try:
+            while True:
+                request = await self.readRequest(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                log.debug(f'{client[0]} {method} {path}')
+                if method == 'GET' and urlsplit(path).path == '/ws' and websocket.isUpgrade(headers):
+                    await self.websocket(reader, writer, path, headers)
+                    break
+                elif method == 'GET' and 'stream.jpg' in path:
+                    await self.stream(writer, path)
+                    break
+                elif method == 'GET' and '/change' in path:
+                    await self.changes(writer)
+                    break
+                elif method == 'GET' and urlsplit(path).path.startswith('/telemetry.'):
+                    download = telemetryFile(urlsplit(path).path)
+                    if download is None:
+                        self.response(writer, 404)
+                    else:
+                        contentType, body = download
+                        fileName = urlsplit(path).path[1:]
+                        self.response(writer, 200, [('Content-Type', contentType), 
+                            ('Content-Disposition', f'attachment; filename="{fileName}"')], body)
+                elif method == 'GET' and urlsplit(path).path == '/debug/profile':
+                    # sample in a thread, the event loop is profiled too
+                    try:
+                        contentType, body = await asyncio.get_running_loop().run_in_executor(None, profileRequest, urlsplit(path).query)
+                        self.response(writer, 200, [('Content-Type', contentType)], body)
+                    except ValueError as e:
+                        self.response(writer, 400, [('Content-Type', 'text/plain')], str(e).encode())
+                elif method == 'GET' and urlsplit(path).path == '/debug/trace.json':
+                    if spotter.tracer.enabled:
+                        self.response(writer, 200, [('Content-Type', 'application/json')], spotter.tracer.chromeTrace())
+                    else:
+                        self.response(writer, 404)
+                elif method == 'GET' and urlsplit(path).path == '/metrics':
+                    self.response(writer, 200, [('Content-Type', metrics.contentType)], metricsText())
+                elif method == 'GET':
+                    self.staticFile(writer, path)
+                elif method == 'POST':
+                    handlePost(path, body)
+                    self.response(writer, 200, [('Content-type', 'text/html')])
+                else:
+                    self.response(writer, 501)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            log.info(f'Removed streaming client {client}')
+        except Exception:
+            log.exception(f'Failed to handle request of {client}')
+        finally:
+            writer.close()
+    
+
+    def staticFile(self, writer, path):
+        '''
+        Responds with a file of the static directory
+        '''
+        relPath = unquote(urlsplit(path).path).lstrip('/') or 'index.html'
+        filePath = os.path.abspath(os.path.join(self.directory, relPath))
+        if os.path.isdir(filePath):
+            filePath = os.path.join(filePath, 'index.html')
+        if not filePath.startswith(self.directory + os.sep) or not os.path.isfile(filePath):
+            self.response(writer, 404)
+            return
+        with open(filePath, 'rb') as f:
+            body = f.read()
+        contentType = mimetypes.guess_type(filePath)[0] or 'application/octet-stream'
+        self.response(writer, 200, [('Content-type', contentType)], body)
+    
+
+    async def stream(self, writer, path):
+        '''
+        Sends stream frames as multipart JPEG until the client disconnects
+        '''
+        writer.write(b'HTTP/1.1 200 OK\r\nAge: 0\r\nCache-Control: no-cache, private\r\nPragma: no-cache\r\n'
+            b'Content-Type: multipart/x-mixed-replace; boundary=FRAME\r\n\r\n')
+        variant = StreamVariant.fromQuery(parse_qs(urlsplit(path).query))
+        with spotter.frames.subscribe() as cursor:
+            while True:
+                frame = await self.nextImage(cursor, variant)
+                spotter.tracer.annotate(stream=cursor.seq)
+                with spotter.tracer.span('write'):
+                    writer.write(b'--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(frame))
+                    writer.write(frame)
+                    writer.write(b'\r\n\r\n')
+                await writer.drain() # slow clients skip frames instead of queueing them
+    
+
+    async def nextImage(self, cursor, variant):
+        '''
+        Waits for a stream frame newer than the cursor and encodes it in the encoding threads
+
+        :param cursor: FrameCursor of the client, advanced to the encoded frame
+        :param variant: StreamVariant
+        :returns: image bytes
+        '''
+        while True:
+            event = self.newFrame # before checking to not miss frames published meanwhile
+            frame = spotter.frames.newer(cursor.seq)
+            if frame is not None:
+                break
+            await event.wait()
+        cursor.seq, image = await self.loop.run_in_executor(self.encodePool, spotter.streamImageVariant, variant, frame)
+        return image
+    
+
+    async def changes(self, writer):
+        '''
+        Sends server sent events until the client disconnects
+        '''
+        writer.write(b'HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\nContent-type: text/event-stream\r\n\r\n')
+        with hub.subscribe() as cursor:
+            while True:
+                event = self.newEvent # before reading to not miss events published meanwhile
+                messages = cursor.read()
+                if messages:
+                    # send data to client
+                    writer.writelines(sseMessage(message) for message in messages)
+                    await writer.drain()
+                try:
+                    await asyncio.wait_for(event.wait(), 15)
+                except asyncio.TimeoutError:
+                    writer.write(b': keep-alive\n\n') # detect closed connections
+                    await writer.drain()
+    
+    
+
+    async def websocket(self, reader, writer, path, headers):
+        '''
+        Sends stream frames and events over a WebSocket and applies commands of the client
+        '''
+        writer.write(websocket.handshakeResponse(headers['sec-websocket-key']))
+        variant = StreamVariant.fromQuery(parse_qs(urlsplit(path).query))
+        senders = [asyncio.ensure_future(self.websocketFrames(writer, variant)), 
+            asyncio.ensure_future(self.websocketEvents(writer))]
+        try:
+            assembler = websocket.MessageAssembler()
+            while True:
+                message = assembler.feed(*await websocket.readFrameAsync(reader))
+                if message is None:
+                    continue
+                opcode, payload = message
+                if opcode == websocket.Opcode.CLOSE:
+                    writer.write(websocket.closeFrame())
+                    break
+                elif opcode == websocket.Opcode.PING:
+                    writer.write(websocket.frame(payload, websocket.Opcode.PONG))
+                elif opcode == websocket.Opcode.TEXT:
+                    websocketCommand(payload)
+        except ValueError as e:
+            log.debug(f'WebSocket failed: {e}')
+        finally:
+            for sender in senders:
+                sender.cancel()
+    
+
+    async def websocketFrames(self, writer, variant):
+        '''
+        Sends stream frames as binary messages, frames arriving while sending are skipped
+        '''
+        try:
+            with spotter.frames.subscribe() as cursor:
+                while True:
+                    frame = await self.nextImage(cursor, variant)
+                    spotter.tracer.annotate(stream=cursor.seq)
+                    with spotter.tracer.span('write'):
+                        writer.writelines((websocket.frameHeader(len(frame)), frame))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+    
+
+    async def websocketEvents(self, writer):
+        '''
+        Sends events as text messages
+        '''
+        try:
+            with hub.subscribe() as cursor:
+                while True:
+                    event = self.newEvent # before reading to not miss events published meanwhile
+                    messages = cursor.read()
+                    for message in messages:
+                        writer.writelines((websocket.frameHeader(len(message), websocket.Opcode.TEXT), message))
+                    if messages:
+                        await writer.drain()
+                    await event.wait()
+        except ConnectionError:
+            pass
+
+
 if __name__ == '__main__':
     with PiCamera(resolution=(1920, 1080), framerate_range=(3, 30)) as camera:
         camera.meter_mode = 'spot'
         camera.exposure_mode = 'verylong'
-        with FrameAnalysis(camera) as spotter:
+        with FrameAnalysis(camera, queueSize=emulation.clargs.queue, dropPolicy=DropPolicy(emulation.clargs.drop)) as spotter:
+            spotter.analysisInterval = emulation.clargs.interval or None
+            spotter.pyramid = emulation.clargs.pyramid
+            spotter.timings.enabled = emulation.clargs.measure
+            if emulation.clargs.trace > 0:
+                spotter.tracer = spotter.timings.tracer = Tracer(emulation.clargs.trace, enabled=True)
+            spotter.telemetry = Telemetry(emulation.clargs.records) if emulation.clargs.records > 0 else None
+            spotter.encoder = makeEncoder(emulation.clargs.jpeg, subsampling=emulation.clargs.chroma)
+            log.info(f'Encoding stream with {spotter.encoder}')
+            if emulation.clargs.backend == 'process':
+                spotter.backend = ProcessBackend(tileWorkers=emulation.clargs.tiles)
+            elif emulation.clargs.tiles > 0:
+                spotter.tilePool = ThreadPoolExecutor(emulation.clargs.tiles, thread_name_prefix='tile')
+            spotter.settingsHandler = applySettings
+            EventBroadcaster().start()
             log.debug('Starting frame analysis')
             camera.start_recording(spotter, format='yuv')
             # start server
             try:
                 log.debug('Starting HTTP server')
-                server = StreamingServer(('', 8000), StreamingHandler)
-                log.info(f'Started user interface on http://{server.server_name}:{server.server_port}')
-                log.info('Press ctrl-C to stop')
-                server.serve_forever()
+                if emulation.clargs.server == 'asyncio':
+                    AsyncStreamingServer(('', 8000)).run()
+                else:
+                    server = StreamingServer(('', 8000), StreamingHandler)
+                    log.info(f'Started user interface on http://{server.server_name}:{server.server_port}')
+                    log.info('Press ctrl-C to stop')
+                    server.serve_forever()
             except KeyboardInterrupt:
                 pass
             finally:
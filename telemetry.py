@@ -0,0 +1,99 @@
+import io # for serializing the records
+import numpy as np # for the record buffer
+from threading import Lock # for reading while the analysis records
+from enum import IntEnum # for result codes
+
+
+class ResultCode(IntEnum):
+    NONE = 0 # no analysis of this frame
+    SKIPPED = 1 # no change could reach the threshold
+    NO_CHANGE = 2
+    VALID = 3 # valid change detected
+    TOO_MUCH = 4 # changes are too large or not square
+
+
+# stages of the Analysis with durations in each record
+analysisStages = ('diff', 'smooth', 'gate', 'cfar', 'pyramid', 'threshold', 'label')
+
+
+class Telemetry:
+    '''
+    Ring buffer of compact per-frame records for post-mortem analysis
+
+    Records are kept in a preallocated structured array,
+    the oldest records are overwritten when it is full.
+    Durations are in milliseconds, NaN if not measured.
+    '''
+    def __init__(self, size=10000, stages=analysisStages):
+        '''
+        :param size: number of kept records
+        :param stages: names of stages with a duration field each
+        '''
+        self.dtype = np.dtype([
+            ('time', 'f8'), # capture time in seconds since the epoch
+            ('frame', 'u4'), # frame count
+            ('state', 'u1'), # State value
+            ('result', 'u1'), # ResultCode value
+            ('thresh', 'i2'), # threshold chosen by the analysis or set threshold without analysis
+            ('changed', 'i4'), # number of pixels at or above the threshold
+            ('luminance', 'f4'), # mean luminance of the analysed area
+            ('process', 'f4'), # processing duration of the frame
+            ('analysis', 'f4') # analysis duration
+        ] + [(stage, 'f4') for stage in stages])
+        self.stages = stages
+        self.records = np.zeros(size, dtype=self.dtype)
+        self.empty = np.zeros((), dtype=self.dtype) # record template
+        for name in self.dtype.names:
+            if self.dtype[name].kind == 'f':
+                self.empty[name] = np.nan
+        self.count = 0 # number of recorded frames
+        self.lock = Lock()
+    
+
+    def __len__(self):
+        return min(self.count, len(self.records))
+    
+
+    def record(self, **fields):
+        '''
+        Adds the record of a frame, overwriting the oldest when full
+
+        :param fields: field name: value, missing fields are 0 or NaN
+        '''
+        with self.lock:
+            row = self.count%len(self.records)
+            self.records[row] = self.empty
+            for name, value in fields.items():
+                self.records[name][row] = value
+            self.count += 1
+    
+
+    def snapshot(self):
+        '''
+        :returns: copy of the records from the oldest to the newest
+        '''
+        with self.lock:
+            if self.count <= len(self.records):
+                return self.records[:self.count].copy()
+            row = self.count%len(self.records)
+            return np.concatenate((self.records[row:], self.records[:row]))
+    
+
+    def npy(self):
+        '''
+        :returns: bytes of the records in the NumPy .npy format
+        '''
+        buffer = io.BytesIO()
+        np.save(buffer, self.snapshot())
+        return buffer.getvalue()
+    
+
+    def csv(self):
+        '''
+        :returns: bytes of the records as comma separated values with a header line
+        '''
+        formats = {'f8': '%.6f', 'f4': '%.3f'}
+        fmt = [formats.get(self.dtype[name].str[1:], '%d') for name in self.dtype.names]
+        buffer = io.StringIO()
+        np.savetxt(buffer, self.snapshot(), fmt=fmt, delimiter=',', header=','.join(self.dtype.names), comments='')
+        return buffer.getvalue().encode()
@@ -0,0 +1,167 @@
+import numpy as np # for percentiles
+from bisect import bisect_left # for histogram buckets
+from threading import Lock # for recording from several threads
+import time # for performance measurement
+
+
+class Span:
+    '''
+    Context manager measuring the duration of a block
+    '''
+    __slots__ = ('record', 'name', 'start')
+
+    def __init__(self, record, name):
+        '''
+        :param record: function taking the name and the duration in seconds
+        :param name: stage name
+        '''
+        self.record = record
+        self.name = name
+    
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+
+    def __exit__(self, *args):
+        self.record(self.name, time.perf_counter()-self.start)
+
+
+class NullSpan:
+    '''
+    Context manager doing nothing, used when timing is disabled
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+    
+
+    def __exit__(self, *args):
+        pass
+
+
+nullSpan = NullSpan() # shared, so disabled spans do not allocate
+
+
+class StageTimes(dict):
+    '''
+    Durations of the stages of one run, e.g. of one Analysis, as stage name: seconds
+
+    Plain dictionary content, so it can be pickled and sent from a worker process.
+    '''
+    def __init__(self, enabled=False):
+        '''
+        :param enabled: False to make spans no-ops
+        '''
+        super().__init__()
+        self.enabled = enabled
+    
+
+    def span(self, name):
+        '''
+        :param name: stage name, durations of repeated stages are summed
+        :returns: context manager measuring the stage
+        '''
+        return Span(self.add, name) if self.enabled else nullSpan
+    
+
+    def add(self, name, seconds):
+        self[name] = self.get(name, 0.) + seconds
+
+
+class Timings:
+    '''
+    Rolling statistics of the durations of named stages
+
+    The last size durations of each stage are kept in a ring buffer,
+    percentiles are computed from them on request.
+    Additionally, all durations are counted in histogram buckets.
+    '''
+    def __init__(self, size=500, enabled=False, buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5)):
+        '''
+        :param size: number of durations kept per stage
+        :param enabled: False to make spans no-ops
+        :param buckets: increasing upper bounds in seconds of the histogram buckets, 
+            durations above the last bound are counted in an extra bucket
+        '''
+        self.size = size
+        self.enabled = enabled
+        self.buckets = buckets
+        self.lock = Lock()
+        self.samples = {} # stage name: [ring buffer of seconds, number of recorded durations, bucket counts, sum of seconds]
+        self.tracer = None # optional tracing.Tracer also getting the spans as trace events
+    
+
+    def span(self, name):
+        '''
+        :param name: stage name
+        :returns: context manager recording the duration of the stage
+        '''
+        if self.tracer is not None and self.tracer.enabled:
+            return self.tracer.span(name, self.record if self.enabled else None)
+        return Span(self.record, name) if self.enabled else nullSpan
+    
+
+    def record(self, name, seconds):
+        '''
+        Adds a duration of a stage
+
+        :param name: stage name
+        :param seconds: duration in seconds
+        '''
+        with self.lock:
+            entry = self.samples.get(name)
+            if entry is None:
+                entry = self.samples[name] = [np.zeros(self.size), 0, [0]*(len(self.buckets)+1), 0.]
+            entry[0][entry[1]%self.size] = seconds
+            entry[1] += 1
+            entry[2][bisect_left(self.buckets, seconds)] += 1
+            entry[3] += seconds
+    
+
+    def recordAll(self, stageTimes, prefix=''):
+        '''
+        Adds the durations of one run
+
+        :param stageTimes: dictionary of stage name: seconds, e.g. StageTimes
+        :param prefix: prefix for the stage names
+        '''
+        for name, seconds in stageTimes.items():
+            self.record(prefix+name, seconds)
+    
+
+    def stats(self, percentiles=(50, 95, 99)):
+        '''
+        :param percentiles: percentiles (0...100) to compute
+        :returns: dictionary of stage name: dictionary with total "count",
+            "mean" and "p<percentile>" durations in seconds of the kept durations,
+            stages in order of their first record
+        '''
+        with self.lock:
+            samples = [(name, entry[0][:entry[1]].copy(), entry[1]) for name, entry in self.samples.items()]
+        stats = {}
+        for name, durations, count in samples:
+            values = np.percentile(durations, percentiles)
+            stats[name] = {'count': count, 'mean': float(durations.mean())}
+            stats[name].update({f'p{p}': float(value) for p, value in zip(percentiles, values)})
+        return stats
+    
+
+    def histograms(self):
+        '''
+        :returns: dictionary of stage name: (cumulative counts of durations at or below each bucket bound 
+            and of all durations, sum of all durations in seconds)
+        '''
+        with self.lock:
+            samples = [(name, list(entry[2]), entry[3]) for name, entry in self.samples.items()]
+        return {name: (np.cumsum(counts).tolist(), total) for name, counts, total in samples}
+    
+
+    def clear(self):
+        '''
+        Forgets all durations
+        '''
+        with self.lock:
+            self.samples.clear()
@@ -0,0 +1,115 @@
+import json # for the trace file
+import os # for the process id
+import threading # for thread ids and names
+import time # for timestamps
+from collections import deque # for the bounded event buffer
+from timing import nullSpan # for disabled tracing
+
+
+class TraceSpan:
+    '''
+    Context manager adding a complete event for a block to a Tracer
+    '''
+    __slots__ = ('tracer', 'name', 'record', 'start')
+
+    def __init__(self, tracer, name, record=None):
+        '''
+        :param tracer: Tracer
+        :param name: span name
+        :param record: optional function taking the name and the duration in seconds, e.g. Timings.record
+        '''
+        self.tracer = tracer
+        self.name = name
+        self.record = record
+    
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+
+    def __exit__(self, *args):
+        duration = time.perf_counter()-self.start
+        self.tracer.complete(self.name, self.start, duration)
+        if self.record is not None:
+            self.record(self.name, duration)
+
+
+class Tracer:
+    '''
+    Opt-in recorder of spans for the Chrome trace event format
+
+    Each span is kept as a complete event with its begin and duration,
+    its thread and the frame numbers the thread annotated.
+    Only the latest events are kept.
+    The trace shows how the camera thread, the analysis, the encoding and the HTTP writers overlap,
+    e.g. in chrome://tracing or https://ui.perfetto.dev
+    '''
+    def __init__(self, size=100000, enabled=False):
+        '''
+        :param size: number of kept events
+        :param enabled: False to make spans no-ops
+        '''
+        self.enabled = enabled
+        self.events = deque(maxlen=size) # (name, start in seconds, duration in seconds, thread id, args)
+        self.threadNames = {} # thread id: name
+        self.local = threading.local() # args of the current thread
+        self.pid = os.getpid()
+        self.origin = time.perf_counter() # time zero of the trace
+    
+
+    def annotate(self, **args):
+        '''
+        Sets the arguments of the following events of the current thread, e.g. the frame number
+
+        :param args: argument name: value
+        '''
+        if self.enabled:
+            self.local.args = args
+    
+
+    def span(self, name, record=None):
+        '''
+        :param name: span name
+        :param record: optional function also taking the name and duration
+        :returns: context manager tracing the block
+        '''
+        return TraceSpan(self, name, record) if self.enabled else nullSpan
+    
+
+    def complete(self, name, start, duration):
+        '''
+        Adds an event of the current thread
+
+        :param name: span name
+        :param start: time.perf_counter() at the begin
+        :param duration: duration in seconds
+        '''
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        self.threadNames[thread.native_id] = thread.name
+        self.events.append((name, start, duration, thread.native_id, getattr(self.local, 'args', None)))
+    
+
+    def chromeTrace(self):
+        '''
+        :returns: JSON bytes of the events in the Chrome trace event format
+        '''
+        events = list(self.events) # deque appends are atomic, copy before iterating
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in list(self.threadNames.items())]
+        for name, start, duration, tid, args in events:
+            event = {'name': name, 'cat': 'pipeline', 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': round((start-self.origin)*1e6, 1), 'dur': round(duration*1e6, 1)}
+            if args:
+                event['args'] = args
+            trace.append(event)
+        return json.dumps({'traceEvents': trace, 'displayTimeUnit': 'ms'}).encode()
+    
+
+    def clear(self):
+        '''
+        Forgets all events
+        '''
+        self.events.clear()
@@ -0,0 +1,178 @@
+import base64 # for the handshake
+import hashlib # for the handshake
+import struct # for frame headers
+from enum import IntEnum # for opcodes
+
+
+class Opcode(IntEnum):
+    CONTINUATION = 0x0
+    TEXT = 0x1
+    BINARY = 0x2
+    CLOSE = 0x8
+    PING = 0x9
+    PONG = 0xA
+
+
+guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11' # fixed by RFC 6455
+maxMessageSize = 1 << 20 # limit of inbound messages in bytes
+
+
+def isUpgrade(headers):
+    '''
+    :param headers: dictionary-like request headers with case-insensitive or lower case keys
+    :returns: True if the request asks for a WebSocket connection
+    '''
+    return (headers.get('upgrade', '').lower() == 'websocket'
+        and 'upgrade' in headers.get('connection', '').lower()
+        and bool(headers.get('sec-websocket-key')))
+
+
+def acceptKey(key):
+    '''
+    :param key: Sec-WebSocket-Key request header value
+    :returns: Sec-WebSocket-Accept response header value
+    '''
+    return base64.b64encode(hashlib.sha1((key + guid).encode()).digest()).decode()
+
+
+def handshakeResponse(key):
+    '''
+    :param key: Sec-WebSocket-Key request header value
+    :returns: bytes of the response switching protocols
+    '''
+    return ('HTTP/1.1 101 Switching Protocols\r\n'
+        'Upgrade: websocket\r\n'
+        'Connection: Upgrade\r\n'
+        f'Sec-WebSocket-Accept: {acceptKey(key)}\r\n\r\n').encode()
+
+
+def frameHeader(length, opcode=Opcode.BINARY, fin=True):
+    '''
+    Header of an unmasked frame sent by the server, the payload follows unchanged
+
+    :param length: payload length in bytes
+    :param opcode: frame opcode
+    :param fin: False if more fragments follow
+    :returns: header bytes
+    '''
+    first = (0x80 if fin else 0) | opcode
+    if length < 126:
+        return struct.pack('!BB', first, length)
+    elif length < 1 << 16:
+        return struct.pack('!BBH', first, 126, length)
+    return struct.pack('!BBQ', first, 127, length)
+
+
+def frame(payload, opcode=Opcode.BINARY):
+    '''
+    :returns: bytes of a complete unmasked frame
+    '''
+    return frameHeader(len(payload), opcode) + payload
+
+
+def closeFrame(code=1000):
+    '''
+    :param code: close status code, 1000 for normal closure
+    :returns: bytes of a close frame
+    '''
+    return frame(struct.pack('!H', code), Opcode.CLOSE)
+
+
+def unmask(payload, mask):
+    '''
+    :param payload: masked payload bytes
+    :param mask: 4 byte masking key
+    :returns: unmasked payload bytes
+    '''
+    n = len(payload)
+    key = (mask * (n//4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(n, 'big')
+
+
+def parseHeader(head):
+    '''
+    :param head: first 2 bytes of a frame
+    :returns: fin flag, opcode, masked flag, 7 bit length, number of extended length bytes
+    '''
+    fin, opcode = bool(head[0] & 0x80), head[0] & 0x0F
+    masked, length = bool(head[1] & 0x80), head[1] & 0x7F
+    return fin, opcode, masked, length, {126: 2, 127: 8}.get(length, 0)
+
+
+def readFrame(read):
+    '''
+    Reads a frame from a blocking stream
+
+    :param read: function returning n bytes, e.g. rfile.read of a request handler
+    :returns: fin flag, opcode, unmasked payload bytes
+    :raises ConnectionError: if the stream ended
+    :raises ValueError: if the frame is larger than maxMessageSize
+    '''
+    def readExactly(n):
+        data = read(n)
+        if len(data) < n:
+            raise ConnectionError('WebSocket stream ended')
+        return data
+    fin, opcode, masked, length, extSize = parseHeader(readExactly(2))
+    if extSize:
+        length = int.from_bytes(readExactly(extSize), 'big')
+    if length > maxMessageSize:
+        raise ValueError(f'WebSocket frame of {length} bytes is too large')
+    mask = readExactly(4) if masked else None
+    payload = readExactly(length) if length else b''
+    return fin, opcode, unmask(payload, mask) if masked else payload
+
+
+async def readFrameAsync(reader):
+    '''
+    Reads a frame from an asyncio stream
+
+    :param reader: asyncio.StreamReader
+    :returns: fin flag, opcode, unmasked payload bytes
+    :raises asyncio.IncompleteReadError: if the stream ended
+    :raises ValueError: if the frame is larger than maxMessageSize
+    '''
+    fin, opcode, masked, length, extSize = parseHeader(await reader.readexactly(2))
+    if extSize:
+        length = int.from_bytes(await reader.readexactly(extSize), 'big')
+    if length > maxMessageSize:
+        raise ValueError(f'WebSocket frame of {length} bytes is too large')
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length) if length else b''
+    return fin, opcode, unmask(payload, mask) if masked else payload
+
+
+class MessageAssembler:
+    '''
+    Joins fragmented data frames to messages, control frames pass through
+    '''
+    def __init__(self):
+        self.opcode = None # opcode of the message in progress
+        self.fragments = []
+        self.size = 0
+    
+
+    def feed(self, fin, opcode, payload):
+        '''
+        :param fin: fin flag of the frame
+        :param opcode: opcode of the frame
+        :param payload: unmasked payload bytes of the frame
+        :returns: (opcode, payload) of a complete message or control frame, None if fragments are missing
+        :raises ValueError: for unexpected continuations or too large messages
+        '''
+        if opcode >= Opcode.CLOSE:
+            return opcode, payload
+        if opcode == Opcode.CONTINUATION:
+            if self.opcode is None:
+                raise ValueError('WebSocket continuation without message')
+        else:
+            self.opcode, self.fragments, self.size = opcode, [], 0
+        self.fragments.append(payload)
+        self.size += len(payload)
+        if self.size > maxMessageSize:
+            raise ValueError(f'WebSocket message of {self.size} bytes is too large')
+        if not fin:
+            return None
+        message = (self.opcode, b''.join(self.fragments))
+        self.opcode, self.fragments, self.size = None, [], 0
+        return message